@@ -0,0 +1,355 @@
+"""benchmarks for vectorgame_clean.py, running without a window
+   (SDL dummy video driver).
+   Micro benchmarks: kill, particles, beams, players, sprites, startup.
+   Scenarios: scripted matches with the real Viewer drawing code (ffa, bubblestorm,
+   cascade, hud), reporting frame time percentiles. Results can be saved as
+   json and compared with an older result:
+   usage: python3 benchmark.py [names] [--sprites] [--save new.json] [--compare old.json]"""
+
+import os
+import sys
+import time
+import json
+import argparse
+import gc
+import tracemalloc
+import tempfile
+import subprocess
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+import vectorgame_clean as vg
+
+
+def setup(width=1024, height=800, **kwargs):
+    """a new World without window and without Viewer. kwargs go to World"""
+    vg.init_headless()
+    return vg.World(width, height, **kwargs)
+
+
+def bench_kill(sprite_counts=(100, 1000, 5000, 20000), kills=2000):
+    """kill throughput (kills per second) of beams with a boss, for a growing number of other sprites.
+       Should stay flat: kill() visits only the underlings, not all sprites"""
+    results = []
+    for count in sprite_counts:
+        world = setup()
+        color = (255, 0, 0)
+        for _ in range(count):
+            vg.VectorSprite(pos=pygame.math.Vector2(100, 100), color=color)
+        boss = vg.VectorSprite(pos=pygame.math.Vector2(200, 200), color=color)
+        beams = [vg.Beam(boss=boss, pos=pygame.math.Vector2(200, 200),
+                         move=pygame.math.Vector2(100, 0), color=color) for _ in range(kills)]
+        start = time.perf_counter()
+        for beam in beams:
+            beam.kill()
+        seconds = time.perf_counter() - start
+        alive = len(world.allgroup) + kills
+        results.append({"sprites": alive, "kills": kills, "seconds": seconds,
+                        "kills_per_second": kills / seconds})
+        print("{:>7} sprites alive: {:>12.0f} kills per second".format(alive, kills / seconds))
+    return results
+
+
+def bench_particles(counts=(1000, 10000, 20000), frames=120):
+    """milliseconds per frame for ParticleSystem update and draw with a number of living particles"""
+    results = []
+    world = setup()
+    screen = pygame.Surface((vg.World.width, vg.World.height))
+    for count in counts:
+        particles = vg.ParticleSystem(seed=1)
+        for _ in range(count // 100):
+            particles.emit(vg.World.width // 2, vg.World.height // 2, (200, 100, 50), 100)
+        start = time.perf_counter()
+        for _ in range(frames):
+            particles.max_age[:particles.count] += world.dt # keep all of them alive
+            particles.update(world.dt)
+            particles.draw(screen)
+        ms = (time.perf_counter() - start) * 1000 / frames
+        results.append({"particles": count, "ms_per_frame": ms})
+        print("{:>7} particles: {:>8.3f} ms per frame".format(count, ms))
+    return results
+
+
+def bench_beams(reload_times=(0.15, 0.03, 0), ticks=600):
+    """milliseconds per World.step with 4 players on permanent fire,
+       Beam sprites compared with the BeamSystem"""
+    results = []
+    for reload_time in reload_times:
+        for use_array in (False, True):
+            world = setup(seed=1, beams=use_array)
+            for p in world.playergroup:
+                p.reload_time = reload_time
+            for tick in range(ticks):
+                if tick == ticks // 2:
+                    start = time.perf_counter() # measure only the second half, when beams are flying
+                world.step(world.dt, [vg.Command(turn=1, aim=-1)] * 4)
+            ms = (time.perf_counter() - start) * 1000 / (ticks - ticks // 2)
+            alive = len(world.beams) if world.beams is not None else len(world.bulletgroup)
+            kind = "BeamSystem" if use_array else "Beam sprites"
+            results.append({"reload_time": reload_time, "kind": kind, "beams": alive, "ms_per_tick": ms})
+            print("{:>12} {:>6} beams alive: {:>8.3f} ms per tick".format(kind, alive, ms))
+    return results
+
+
+def bench_players(counts=(4, 16, 64), ticks=600):
+    """milliseconds per World.step with many players, all steered by bots"""
+    results = []
+    for count in counts:
+        world = setup(seed=1, players=count, bots=count)
+        for tick in range(ticks):
+            if tick == ticks // 2:
+                start = time.perf_counter() # second half: beams are flying
+            world.step(world.dt)
+        ms = (time.perf_counter() - start) * 1000 / (ticks - ticks // 2)
+        results.append({"players": count, "ms_per_tick": ms})
+        print("{:>4} players: {:>8.3f} ms per tick".format(count, ms))
+    return results
+
+
+def bench_sprites(count=20000):
+    """sprites created per second (new objects, without SpritePool) and bytes per
+       living sprite (python objects only, measured with tracemalloc; shared images
+       are not counted, the own image of a Bubble is)"""
+    results = []
+    world = setup(seed=1)
+    boss = world.playergroup.sprites()[0]
+    makers = {"Beam": lambda: vg.Beam(boss=boss, pos=pygame.math.Vector2(200, 200),
+                                      move=pygame.math.Vector2(100, 0), color=boss.color, angle=30),
+              "Bubble": lambda: vg.Bubble(pos=pygame.math.Vector2(300, 300), color=(200, 100, 50),
+                                          move=pygame.math.Vector2(30, 0)),
+              "Flytext": lambda: vg.Flytext(pos=pygame.math.Vector2(300, 300), text="-1")}
+    for name, make in makers.items():
+        make() # images and texts into their caches
+        start = time.perf_counter()
+        sprites = [make() for _ in range(count)]
+        seconds = time.perf_counter() - start
+        del sprites
+        setup(seed=1) # new groups and pools, the sprites are gone
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        sprites = [make() for _ in range(count)]
+        size = (tracemalloc.get_traced_memory()[0] - before) / count
+        tracemalloc.stop()
+        del sprites
+        setup(seed=1)
+        results.append({"class": name, "sprites_per_second": count / seconds, "bytes_per_sprite": size})
+        print("{:>8}: {:>9.0f} sprites per second, {:>6.0f} bytes per sprite".format(name, count / seconds, size))
+    return results
+
+
+# ----------------- scenarios ---------------------
+
+def bench_startup(runs=5):
+    """milliseconds from the start of python to the first frame of a Viewer, in new
+       processes: the first one with an empty font cache (FontPaths), the others with
+       the cache it wrote. Returns the startup phases (StartupTimer) of each run"""
+    code = ("import time; start = time.perf_counter()\n"
+            "import pygame, vectorgame_clean as vg\n"
+            "vg.launch_time = start\n"
+            "viewer = vg.Viewer(1024, 800, seed=1)\n"
+            "pygame.event.post(pygame.event.Event(pygame.QUIT))\n"
+            "viewer.run()\n")
+    results = []
+    with tempfile.TemporaryDirectory() as cache:
+        env = dict(os.environ, XDG_CACHE_HOME=cache)
+        for run in range(runs):
+            output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+            line = [line for line in output.splitlines() if line.startswith("startup:")][0]
+            fonts = [line for line in output.splitlines() if line.startswith("font paths:")][0]
+            print("{:>5} font cache, {}  ({})".format("empty" if run == 0 else "warm", line, fonts))
+            phases = dict((phase, float(ms)) for phase, ms in
+                          (part.rsplit(" ", 1) for part in line.partition("(")[2].rstrip(")").split(", ")))
+            phases["total"] = float(line.split()[1])
+            results.append(phases)
+    return results
+
+
+def make_viewer(seed=1, arrays=True, width=1024, height=800, trail=False):
+    """a Viewer on SDL's dummy video driver, without running the mainloop"""
+    vg.init_headless()
+    viewer = vg.Viewer(width, height, seed=seed, arrays=arrays, trail=trail)
+    viewer.prewarm() # done by run() after the first frame
+    return viewer
+
+
+def scenario_ffa(viewer, frame):
+    """4 players on permanent fire, turning, moving and aiming"""
+    commands = []
+    for nr in range(4):
+        turn = 1 if (frame // 90 + nr) % 3 == 0 else -0.5
+        thrust = 1 if (frame // 120 + nr) % 2 == 0 else -1
+        commands.append(vg.Command(turn, thrust, 1 - nr / 2))
+    return commands
+
+
+def scenario_bubblestorm(viewer, frame, hits_per_second=3000):
+    """explosions (World.explode, like beam hits) all over the screen"""
+    world = viewer.world
+    players = world.playergroup.sprites()
+    for i in range(hits_per_second // 60):
+        p = players[i % len(players)]
+        pos = pygame.math.Vector2(world.rng.randint(0, vg.World.width),
+                                  world.rng.randint(vg.World.hud_height, vg.World.height))
+        world.explode(pos, pygame.math.Vector2(1, 0), world.rng.randint(0, 359), p.color)
+    return None
+
+
+def scenario_cascade(viewer, frame, bosses=10, underlings=50):
+    """mass kill cascades: bosses with many beams as underlings, killed one frame later"""
+    old_bosses = getattr(viewer, "bosses", [])
+    for boss in old_bosses:
+        boss.kill()
+    viewer.bosses = []
+    for b in range(bosses):
+        pos = pygame.math.Vector2(100 + b * 80, 400)
+        boss = vg.VectorSprite(pos=pos, color=(0, 0, 255))
+        vg.Flytext.pool.acquire(pos=pygame.math.Vector2(pos), text=str(frame), max_age=0.5)
+        for u in range(underlings):
+            vg.Beam.pool.acquire(boss=boss, pos=pygame.math.Vector2(pos), move=pygame.math.Vector2(50, 0),
+                                 color=(255, 0, 0), angle=u * 7)
+        viewer.bosses.append(boss)
+    return None
+
+
+def scenario_hud(viewer, frame):
+    """many hud changes and flying texts: every player switches aiming and target every few frames"""
+    switches = vg.SWITCH_AIMING if frame % 5 == 0 else 0
+    if frame % 7 == 0:
+        switches |= vg.SWITCH_TARGET
+    players = viewer.world.playergroup.sprites()
+    for p in players:
+        p.hitpoints = 1 + (frame + p.playernumber * 13) % p.hitpointsfull # keep alive, changing bars
+    if frame % 3 == 0:
+        vg.Flytext.pool.acquire(pos=pygame.math.Vector2(players[frame % 4].pos), text="-{}".format(frame % 100),
+                                max_age=0.5)
+    return [vg.Command(switches=switches)] * len(players)
+
+
+scenarios = {"ffa": scenario_ffa, "bubblestorm": scenario_bubblestorm,
+             "cascade": scenario_cascade, "hud": scenario_hud}
+
+
+def percentile(sorted_values, q):
+    """nearest rank percentile of a sorted list, q between 0 and 100"""
+    index = max(0, min(len(sorted_values) - 1, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(name, frames=600, arrays=True, trail=False, quality=False):
+    """run a scenario for some frames (2 physics steps and one full draw each),
+       returns frame time percentiles, sprites alive and allocations.
+       trail: draw with the trail canvas of the Viewer.
+       quality: a QualityGovernor lowers the quality if the frames are too slow for 60 fps"""
+    viewer = make_viewer(arrays=arrays, trail=trail)
+    world = viewer.world
+    governor = vg.QualityGovernor(viewer.fps) if quality else None
+    script = scenarios[name]
+    pools = (vg.Beam.pool, vg.Bubble.pool, vg.Flytext.pool)
+    blocks = sys.getallocatedblocks()
+    times = []
+    max_alive = 0
+    for frame in range(frames):
+        start = time.perf_counter_ns()
+        commands = script(viewer, frame)
+        for _ in range(2):
+            world.step(world.dt, commands)
+            commands = None if commands is None else [c._replace(switches=0) for c in commands]
+        world.interpolate(1.0)
+        viewer.draw(0)
+        times.append(time.perf_counter_ns() - start)
+        if governor and governor.frame(times[-1] / 1e6) is not None:
+            governor.apply(world, viewer)
+        alive = len(world.allgroup) + len(world.beams or ()) + len(world.particles or ())
+        max_alive = max(max_alive, alive)
+    times.sort()
+    result = {"scenario": name, "arrays": arrays and vg.np is not None, "trail": trail, "frames": frames,
+              "p50_ms": percentile(times, 50) / 1e6, "p95_ms": percentile(times, 95) / 1e6,
+              "p99_ms": percentile(times, 99) / 1e6, "mean_ms": sum(times) / len(times) / 1e6,
+              "sprites_alive": alive, "max_sprites_alive": max_alive,
+              "sprite_allocations": sum(p.allocations for p in pools),
+              "allocated_blocks": sys.getallocatedblocks() - blocks}
+    if governor:
+        result["quality"] = governor.level
+        result["quality_changes"] = len(governor.transitions)
+    print("{:>12}: p50 {:>7.3f} ms  p95 {:>7.3f} ms  p99 {:>7.3f} ms  alive {:>6} (max {:>6})  "
+          "allocations {:>6}  blocks {:>+8}".format(name, result["p50_ms"], result["p95_ms"], result["p99_ms"],
+                                                   alive, max_alive, result["sprite_allocations"],
+                                                   result["allocated_blocks"]))
+    if governor:
+        print("{:>12}  quality: {}".format("", governor.stats()))
+        governor.level = 0
+        governor.apply(world, viewer) # full quality for the next scenario
+    return result
+
+
+def run_replay(filename):
+    """replay a recorded match (vectorgame_clean.py --record FILE) at full speed,
+       returns percentiles of the simulation time of the recorded frames"""
+    world, seconds = vg.replay(filename)
+    times = sorted(seconds)
+    result = {"replay": filename, "frames": len(times), "ticks": world.ticks,
+              "ticks_per_second": world.ticks / sum(times),
+              "p50_ms": percentile(times, 50) * 1000, "p95_ms": percentile(times, 95) * 1000,
+              "p99_ms": percentile(times, 99) * 1000, "mean_ms": sum(times) / len(times) * 1000}
+    print("{:>12}: p50 {:>7.3f} ms  p95 {:>7.3f} ms  p99 {:>7.3f} ms  {:.0f} ticks per second".format(
+          os.path.basename(filename), result["p50_ms"], result["p95_ms"], result["p99_ms"],
+          result["ticks_per_second"]))
+    return result
+
+
+def compare(old, new, tolerance):
+    """list of regressions: scenario frame times (p50, p95, p99) more than tolerance slower than old"""
+    regressions = []
+    for name, result in new.items():
+        if name not in old or "p50_ms" not in result:
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            before, after = old[name][key], result[key]
+            if after > before * (1 + tolerance):
+                regressions.append("{} {}: {:.3f} ms -> {:.3f} ms (+{:.0%})".format(
+                                   name, key, before, after, after / before - 1))
+    return regressions
+
+
+benchmarks = {"kill": bench_kill, "particles": bench_particles, "beams": bench_beams, "players": bench_players,
+              "sprites": bench_sprites, "startup": bench_startup}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmarks for vectorgame")
+    parser.add_argument("names", nargs="*", help="benchmarks and scenarios to run: {}, default: all scenarios (none with --replay)".format(
+                        ", ".join(list(benchmarks) + list(scenarios))))
+    parser.add_argument("--frames", type=int, default=600, help="frames for each scenario")
+    parser.add_argument("--sprites", action="store_true", help="beams and bubbles as sprites instead of numpy arrays")
+    parser.add_argument("--trail", action="store_true", help="scenarios drawn with the trail canvas")
+    parser.add_argument("--quality", action="store_true",
+                        help="scenarios with a QualityGovernor that lowers the quality of slow frames")
+    parser.add_argument("--replay", metavar="FILE", action="append", default=[],
+                        help="also replay a recorded match, can be given more than once")
+    parser.add_argument("--save", metavar="FILE", help="save the results as json")
+    parser.add_argument("--compare", metavar="FILE", help="compare with results saved before")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed slowdown for --compare, 0.15 = 15%%")
+    args = parser.parse_args()
+    results = {}
+    for name in args.names or ([] if args.replay else list(scenarios)):
+        if name in scenarios:
+            results[name] = run_scenario(name, args.frames, not args.sprites, args.trail, args.quality)
+        else:
+            print("---", name, "---")
+            results[name] = benchmarks[name]()
+    for filename in args.replay:
+        results["replay:" + os.path.basename(filename)] = run_replay(filename)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        if regressions:
+            sys.exit(1)
+        print("no regressions (tolerance {:.0%})".format(args.tolerance))
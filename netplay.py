@@ -0,0 +1,604 @@
+"""network multiplayer for vectorgame_clean.py: an authoritative server runs the
+   World and sends snapshots over UDP (asyncio), the clients send their Commands.
+   Snapshots are quantized (half pixels, 1/65536 of a circle for angles) and delta
+   compressed against the last snapshot the client acknowledged, then zlib compressed.
+   Bubbles are not part of the snapshots: the explosions of the server
+   (ParticleSystem.emit) are sent and each client makes its own particles.
+   Needs numpy.
+   usage: python3 netplay.py --serve [--port 5555] [--players 4] [--bots 2]
+          python3 netplay.py --connect HOST[:PORT]
+          python3 netplay.py --loopback [--clients 3] [--latency 50] [--loss 0.05]"""
+
+import os
+import time
+import json
+import zlib
+import struct
+import random
+import asyncio
+import argparse
+import collections
+
+import pygame
+import numpy as np
+import vectorgame_clean as vg
+
+# ---- packets. client -> server: join, input, leave. server -> client: welcome, full, snapshot ----
+JOIN = b"J"
+LEAVE = b"L"
+WELCOME = b"W" # followed by json
+FULL = b"F" # no free player for this client
+# input number, number of the last snapshot received, turn, thrust, aim,
+# number of aiming and target button presses so far (mod 256: lost packets lose no presses)
+INPUT = struct.Struct("<cIIbbbBB")
+# snapshot number, baseline snapshot number (0: none), tick, last input number of this client
+SNAPSHOT = struct.Struct("<cIIII")
+BURST = struct.Struct("<hhBBBB") # x, y, r, g, b, count of an explosion
+ANGLE = 65536 / 360 # quantized angle units per degree
+PLAYER_COLUMNS = 6 # x, y, angle, cannon_angle, hitpoints, aiming + 4 * target
+BEAM_COLUMNS = 4 # x, y, angle, owner
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q / 100))]
+
+
+# ----------------- snapshots ---------------------
+
+def quantize_players(world):
+    """ids (playernumbers) and quantized values (uint16) of all players"""
+    rows = []
+    for p in world.playergroup:
+        target = 0 if p.target == "nearest" else vg.World.player_names[p.target].playernumber + 1
+        rows.append((round(p.pos.x * 2), round(p.pos.y * 2), round(p.angle * ANGLE), round(p.cannon_angle * ANGLE),
+                     p.hitpoints, vg.Player.aimings.index(p.aiming) + 4 * target))
+    values = np.array(rows, dtype="int64").reshape(-1, PLAYER_COLUMNS)
+    return np.arange(len(rows), dtype="uint32"), values.astype("uint16") # negative numbers wrap around
+
+
+def quantize_beams(beams):
+    """ids and quantized values (uint16) of all beams of a BeamSystem"""
+    n = beams.count
+    values = np.empty((n, BEAM_COLUMNS), dtype="int64")
+    values[:, :2] = np.round(beams.pos[:n] * 2)
+    values[:, 2] = np.round(beams.angle[:n] * ANGLE)
+    values[:, 3] = beams.owner[:n]
+    return beams.id[:n].astype("uint32"), values.astype("uint16")
+
+
+def match(ids, base):
+    """positions of ids in the ids of base, and a mask of the ids that are in base.
+       Both id arrays are sorted"""
+    base_ids = base[0]
+    if len(base_ids) == 0 or len(ids) == 0:
+        return np.zeros(len(ids), dtype="int64"), np.zeros(len(ids), dtype=bool)
+    i = np.minimum(np.searchsorted(base_ids, ids), len(base_ids) - 1)
+    return i, base_ids[i] == ids
+
+
+def encode_table(table, base):
+    """bytes of a table (sorted ids, uint16 values with shape (n, columns)).
+       Values of ids that are also in the baseline table base are sent as difference
+       (mod 65536): mostly small numbers or 0, which compress well"""
+    ids, values = table
+    if base is not None:
+        values = values.copy()
+        i, known = match(ids, base)
+        values[known] -= base[1][i[known]]
+    id_steps = np.diff(ids, prepend=np.uint32(0)).astype("<u4")
+    return struct.pack("<I", len(ids)) + id_steps.tobytes() + values.T.astype("<u2").tobytes() # column by column
+
+
+def decode_table(data, offset, columns, base):
+    """table from encode_table() at offset in data, returns the table and the new offset"""
+    n, = struct.unpack_from("<I", data, offset)
+    offset += 4
+    ids = np.cumsum(np.frombuffer(data, "<u4", n, offset)).astype("uint32")
+    offset += 4 * n
+    values = np.frombuffer(data, "<u2", n * columns, offset).reshape(columns, n).T.astype("uint16")
+    offset += 2 * n * columns
+    if base is not None:
+        i, known = match(ids, base)
+        values[known] += base[1][i[known]]
+    return (ids, values), offset
+
+
+def encode_snapshot(snapshot, base, bursts):
+    """payload of a snapshot (players and beams table) as difference to the baseline
+       snapshot base (or None), with the explosions since the last snapshot"""
+    players, beams = snapshot
+    data = [encode_table(players, base and base[0]), encode_table(beams, base and base[1]),
+            struct.pack("<H", len(bursts))]
+    for x, y, color, count in bursts:
+        data.append(BURST.pack(round(x), round(y), color[0], color[1], color[2], min(count, 255)))
+    return zlib.compress(b"".join(data), 1)
+
+
+def decode_snapshot(payload, base):
+    """players, beams and explosions from a payload of encode_snapshot()"""
+    data = zlib.decompress(payload)
+    players, offset = decode_table(data, 0, PLAYER_COLUMNS, base and base[0])
+    beams, offset = decode_table(data, offset, BEAM_COLUMNS, base and base[1])
+    count, = struct.unpack_from("<H", data, offset)
+    bursts = [(x, y, (r, g, b), n) for x, y, r, g, b, n in
+              BURST.iter_unpack(data[offset + 2:offset + 2 + count * BURST.size])]
+    return (players, beams), bursts
+
+
+# ----------------- server ---------------------
+
+class Connection():
+    """a client of the Server, steering one player"""
+
+    def __init__(self, player):
+        self.player = player # playernumber
+        self.acked = 0 # newest snapshot number the client has
+        self.last_input = 0 # newest input number
+        self.command = vg.Command()
+        self.switches = 0 # button presses not yet given to the world
+        self.aim_presses = 0
+        self.target_presses = 0
+        self.last_seen = time.perf_counter()
+        self.bytes_sent = 0
+
+
+class Server(asyncio.DatagramProtocol):
+    """runs the World with its tickrate and sends a snapshot to each client every
+       snapshot_every ticks. Each client steers one player that is not a bot,
+       players without client stand still"""
+    timeout = 5 # seconds without a packet: the client is gone
+
+    def __init__(self, world, snapshot_every=3, history=32):
+        self.world = world
+        self.snapshot_every = snapshot_every
+        self.history = collections.OrderedDict() # snapshot number: (players, beams)
+        self.history_size = history
+        self.number = 0 # of the last snapshot
+        self.clients = {} # address: Connection
+        self.free = list(range(len(world.playergroup) - len(world.bots))) # playernumbers for clients
+        self.bursts_sent = 0 # ParticleSystem.burst_count at the last snapshot
+        self.transport = None
+        self.encode_seconds = 0.0
+        self.encodes = 0
+        self.snapshots = 0
+        self.packet_bytes = [] # size of each snapshot packet
+        self.malformed = 0 # input packets of the wrong size, dropped
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def welcome(self, address, connection):
+        players = self.world.playergroup.sprites()
+        info = {"player": connection.player, "players": len(players), "bots": len(self.world.bots),
+                "width": vg.World.width, "height": vg.World.height, "tickrate": round(1 / self.world.dt),
+                "snapshot_every": self.snapshot_every,
+                "colors": [p.color for p in players], "names": [p.name for p in players]}
+        self.transport.sendto(WELCOME + json.dumps(info).encode(), address)
+
+    def datagram_received(self, data, address):
+        kind = data[:1]
+        connection = self.clients.get(address)
+        if kind == JOIN:
+            if connection is None:
+                if not self.free:
+                    self.transport.sendto(FULL, address)
+                    return
+                connection = Connection(self.free.pop(0))
+                self.clients[address] = connection
+            self.welcome(address, connection) # again if the welcome got lost
+        elif connection is None:
+            return
+        elif kind == b"I":
+            if len(data) != INPUT.size:
+                self.malformed += 1
+                return
+            _, number, acked, turn, thrust, aim, aim_presses, target_presses = INPUT.unpack(data)
+            connection.last_seen = time.perf_counter()
+            connection.acked = max(connection.acked, acked)
+            if number <= connection.last_input:
+                return # old or twice
+            connection.last_input = number
+            scale = vg.InputRecorder.scale
+            connection.command = vg.Command(turn / scale, thrust / scale, aim / scale)
+            if (aim_presses - connection.aim_presses) % 256:
+                connection.switches |= vg.SWITCH_AIMING
+            if (target_presses - connection.target_presses) % 256:
+                connection.switches |= vg.SWITCH_TARGET
+            connection.aim_presses, connection.target_presses = aim_presses, target_presses
+        elif kind == LEAVE:
+            self.drop(address)
+
+    def drop(self, address):
+        connection = self.clients.pop(address)
+        self.free.append(connection.player)
+        self.free.sort()
+
+    def tick(self):
+        """one physics step with the newest commands of the clients, and the snapshots"""
+        world = self.world
+        if world.ticks % world.tickrate == 0:
+            now = time.perf_counter()
+            for address in [a for a, c in self.clients.items() if now - c.last_seen > self.timeout]:
+                self.drop(address)
+        commands = [None] * len(world.playergroup)
+        for connection in self.clients.values():
+            commands[connection.player] = connection.command._replace(switches=connection.switches)
+            connection.switches = 0
+        world.step(world.dt, commands)
+        if world.ticks % self.snapshot_every == 0:
+            self.send_snapshots()
+
+    def send_snapshots(self):
+        world = self.world
+        self.number += 1
+        snapshot = (quantize_players(world), quantize_beams(world.beams))
+        self.history[self.number] = snapshot
+        if len(self.history) > self.history_size:
+            self.history.popitem(last=False)
+        particles = world.particles
+        bursts = []
+        if particles is not None:
+            new = min(particles.burst_count - self.bursts_sent, len(particles.bursts))
+            bursts = list(particles.bursts)[len(particles.bursts) - new:]
+            self.bursts_sent = particles.burst_count
+        payloads = {} # baseline number: payload, clients with the same baseline get the same bytes
+        for address, connection in self.clients.items():
+            baseline = connection.acked if connection.acked in self.history else 0
+            if baseline not in payloads:
+                start = time.perf_counter()
+                payloads[baseline] = encode_snapshot(snapshot, self.history.get(baseline), bursts)
+                self.encode_seconds += time.perf_counter() - start
+                self.encodes += 1
+            packet = SNAPSHOT.pack(b"S", self.number, baseline, world.ticks, connection.last_input) + payloads[baseline]
+            self.transport.sendto(packet, address)
+            connection.bytes_sent += len(packet)
+            self.packet_bytes.append(len(packet))
+        self.snapshots += 1
+
+    async def run(self, seconds=None):
+        """tick with the tickrate of the world, for seconds or forever"""
+        loop = asyncio.get_running_loop()
+        next_time = loop.time()
+        end = None if seconds is None else next_time + seconds
+        while end is None or next_time < end:
+            self.tick()
+            next_time += self.world.dt
+            delay = next_time - loop.time()
+            if delay < -0.25:
+                next_time = loop.time() # too slow, do not catch up
+            await asyncio.sleep(max(0.0, delay))
+
+    def stats(self):
+        sizes = sorted(self.packet_bytes)
+        return {"ticks": self.world.ticks, "snapshots": self.snapshots, "clients": len(self.clients),
+                "malformed": self.malformed,
+                "encode_us": self.encode_seconds / max(1, self.encodes) * 1e6,
+                "packet_bytes_mean": sum(sizes) / max(1, len(sizes)), "packet_bytes_p95": percentile(sizes, 95),
+                "packet_bytes_max": sizes[-1] if sizes else 0}
+
+
+# ----------------- client ---------------------
+
+class Client(asyncio.DatagramProtocol):
+    """sends the Commands of one player to the server and decodes the snapshots.
+       command is a function returning a Command, called input_rate times per second.
+       The newest state is in self.players and self.beams, explosions not yet
+       shown in self.bursts"""
+
+    def __init__(self, command=None, input_rate=60, history=64):
+        self.command = command or vg.Command
+        self.input_rate = input_rate
+        self.history = collections.OrderedDict() # snapshot number: (players, beams)
+        self.history_size = history
+        self.welcome = None # dict from the server
+        self.full = False
+        self.running = True
+        self.transport = None
+        self.latest = 0 # newest snapshot number
+        self.tick = 0 # tick of the server in the newest snapshot
+        self.players = None # (ids, values), see quantize_players()
+        self.beams = None
+        self.bursts = []
+        self.input_number = 0
+        self.aim_presses = 0
+        self.target_presses = 0
+        self.sent_times = collections.OrderedDict() # input number: perf_counter
+        self.latencies = [] # seconds from sending an input until a snapshot includes it
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.decode_seconds = 0.0
+        self.decodes = 0
+        self.undecodable = 0 # snapshots with a baseline that is not in self.history, or corrupt
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def send(self, data):
+        self.transport.sendto(data)
+        self.bytes_sent += len(data)
+
+    def datagram_received(self, data, address):
+        self.bytes_received += len(data)
+        kind = data[:1]
+        if kind == WELCOME:
+            self.welcome = json.loads(data[1:].decode())
+        elif kind == FULL:
+            self.full = True
+        elif kind == b"S":
+            self.snapshot(data)
+
+    def snapshot(self, data):
+        if len(data) < SNAPSHOT.size:
+            self.undecodable += 1
+            return
+        _, number, baseline, tick, input_number = SNAPSHOT.unpack_from(data)
+        if number <= self.latest:
+            return # old or twice, a newer one is already here
+        base = None
+        if baseline:
+            base = self.history.get(baseline)
+            if base is None:
+                self.undecodable += 1
+                return
+        start = time.perf_counter()
+        try:
+            state, bursts = decode_snapshot(data[SNAPSHOT.size:], base)
+        except (zlib.error, struct.error, ValueError): # corrupt, or not from our server
+            self.undecodable += 1
+            return
+        self.decode_seconds += time.perf_counter() - start
+        self.decodes += 1
+        self.history[number] = state
+        if len(self.history) > self.history_size:
+            self.history.popitem(last=False)
+        self.latest, self.tick = number, tick
+        self.players, self.beams = state
+        self.bursts.extend(bursts)
+        # ---- latency: the server has used this input ----
+        now = time.perf_counter()
+        while self.sent_times and next(iter(self.sent_times)) <= input_number:
+            sent_number, sent = self.sent_times.popitem(last=False)
+            if sent_number == input_number:
+                self.latencies.append(now - sent)
+
+    def send_input(self):
+        command = self.command()
+        if command.switches & vg.SWITCH_AIMING:
+            self.aim_presses = (self.aim_presses + 1) % 256
+        if command.switches & vg.SWITCH_TARGET:
+            self.target_presses = (self.target_presses + 1) % 256
+        self.input_number += 1
+        self.sent_times[self.input_number] = time.perf_counter()
+        if len(self.sent_times) > 1000:
+            self.sent_times.popitem(last=False)
+        q = vg.InputRecorder.quantize
+        self.send(INPUT.pack(b"I", self.input_number, self.latest, q(command.turn), q(command.thrust), q(command.aim),
+                             self.aim_presses, self.target_presses))
+
+    async def run(self, seconds=None):
+        """join the server, then send the input until seconds are over or running is False"""
+        loop = asyncio.get_running_loop()
+        end = None if seconds is None else loop.time() + seconds
+        while self.welcome is None and not self.full and self.running:
+            if end is not None and loop.time() > end:
+                return
+            self.send(JOIN) # again, until the welcome arrives
+            await asyncio.sleep(0.25)
+        while self.running and not self.full and (end is None or loop.time() < end):
+            self.send_input()
+            await asyncio.sleep(1 / self.input_rate)
+        self.send(LEAVE)
+
+    def stats(self, seconds):
+        latencies = sorted(self.latencies)
+        return {"player": self.welcome and self.welcome["player"], "snapshots": self.decodes,
+                "undecodable": self.undecodable,
+                "down_bytes_per_second": self.bytes_received / seconds, "up_bytes_per_second": self.bytes_sent / seconds,
+                "decode_us": self.decode_seconds / max(1, self.decodes) * 1e6,
+                "latency_ms_mean": sum(latencies) / max(1, len(latencies)) * 1000,
+                "latency_ms_p95": percentile(latencies, 95) * 1000}
+
+
+class LossyTransport():
+    """wraps a datagram transport for tests: each packet is delayed by
+       latency +- jitter seconds and lost with the probability loss"""
+
+    def __init__(self, transport, latency=0.05, jitter=0.01, loss=0.0, seed=None):
+        self.transport = transport
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.lost = 0
+
+    def sendto(self, data, address=None):
+        if self.rng.random() < self.loss:
+            self.lost += 1
+            return
+        delay = max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+        asyncio.get_running_loop().call_later(delay, self._send, data, address)
+
+    def _send(self, data, address):
+        if not self.transport.is_closing():
+            self.transport.sendto(data, address)
+
+    def close(self):
+        self.transport.close()
+
+
+def random_input(seed):
+    """Command function for test clients: changes turn, thrust and aim now and then,
+       sometimes presses a button"""
+    rng = random.Random(seed)
+    command = [vg.Command()]
+    def next_command():
+        if rng.random() < 0.05:
+            command[0] = vg.Command(rng.uniform(-1, 1), rng.choice((-1, 0, 1, 1)), rng.uniform(-1, 1))
+        switches = rng.choice((vg.SWITCH_AIMING, vg.SWITCH_TARGET)) if rng.random() < 0.01 else 0
+        return command[0]._replace(switches=switches)
+    return next_command
+
+
+async def loopback(clients=3, seconds=10.0, latency=0.05, jitter=0.01, loss=0.05,
+                   players=4, bots=1, seed=1, snapshot_every=3):
+    """server and clients in this process on 127.0.0.1, with latency (one way, in seconds),
+       jitter and packet loss in both directions. Returns a dict of measurements"""
+    vg.init_headless()
+    world = vg.World(1024, 800, seed, players=players, bots=bots)
+    loop = asyncio.get_running_loop()
+    transport, server = await loop.create_datagram_endpoint(lambda: Server(world, snapshot_every),
+                                                            local_addr=("127.0.0.1", 0))
+    server.transport = LossyTransport(transport, latency, jitter, loss, seed)
+    address = transport.get_extra_info("sockname")
+    protocols = []
+    for nr in range(clients):
+        t, client = await loop.create_datagram_endpoint(lambda: Client(random_input(seed + nr)), remote_addr=address)
+        client.transport = LossyTransport(t, latency, jitter, loss, seed + nr + 1)
+        protocols.append(client)
+    await asyncio.gather(server.run(seconds), *(c.run(seconds) for c in protocols))
+    await asyncio.sleep(2 * latency + 2 * jitter) # the last packets
+    result = {"server": server.stats(), "clients": [c.stats(seconds) for c in protocols],
+              "lost_packets": server.transport.lost + sum(c.transport.lost for c in protocols)}
+    for c in protocols:
+        c.transport.close()
+    server.transport.close()
+    return result
+
+
+# ----------------- window for a player ---------------------
+
+def draw(client, screen, particles, images, seconds):
+    """the newest snapshot of client on screen: bubbles, players with crosshair, beams, hud"""
+    info = client.welcome
+    screen.fill((255, 255, 255))
+    for x, y, color, count in client.bursts:
+        particles.emit(x, y, color, count)
+    client.bursts = []
+    particles.update(seconds)
+    particles.draw(screen)
+    if client.players is None:
+        return
+    ids, values = client.players
+    signed = values.view("int16")
+    for nr, row, srow in zip(ids.tolist(), values.tolist(), signed.tolist()):
+        x, y, hitpoints = srow[0] / 2, srow[1] / 2, srow[4]
+        if hitpoints <= 0:
+            continue
+        image = vg.rotation_cache.get(images[nr], row[2] / ANGLE)
+        screen.blit(image, image.get_rect(center=(round(x), round(y))))
+        v = pygame.math.Vector2(85, 0)
+        v.rotate_ip(row[3] / ANGLE)
+        pygame.draw.circle(screen, info["colors"][nr], (round(x + v.x), round(y + v.y)), 10, 1)
+    ids, values = client.beams
+    signed = values.view("int16")
+    for row, srow in zip(values.tolist(), signed.tolist()):
+        image = vg.rotation_cache.get(vg.beam_image(tuple(info["colors"][row[3]])), row[2] / ANGLE)
+        screen.blit(image, image.get_rect(center=(round(srow[0] / 2), round(srow[1] / 2))))
+    # ---- hud: hitpoints ----
+    length = info["width"] // info["players"]
+    for nr, srow in enumerate(client.players[1].view("int16").tolist()):
+        percent = max(0, srow[4]) / 100
+        pygame.draw.rect(screen, info["colors"][nr], (nr * length + 1, 1, int(length * percent) - 2, vg.World.hud_height - 1))
+        pygame.draw.rect(screen, (0, 0, 0), (nr * length, 0, length, vg.World.hud_height), 3 if nr == info["player"] else 1)
+
+
+async def play(host, port):
+    """a window for one player of a server. Keys like player 1: cursor, pgup/pgdown, home/end"""
+    pygame.display.init() # no mixer and no joysticks, the keys of player 1 only
+    switches = [0] # from key events, for the next input
+    def command():
+        pressed = pygame.key.get_pressed()
+        c = vg.Command(pressed[pygame.K_RIGHT] - pressed[pygame.K_LEFT], pressed[pygame.K_UP] - pressed[pygame.K_DOWN],
+                       pressed[pygame.K_PAGEUP] - pressed[pygame.K_PAGEDOWN], switches[0])
+        switches[0] = 0
+        return c
+    loop = asyncio.get_running_loop()
+    transport, client = await loop.create_datagram_endpoint(lambda: Client(command), remote_addr=(host, port))
+    task = asyncio.create_task(client.run())
+    while client.welcome is None and not client.full:
+        await asyncio.sleep(0.05)
+    if client.full:
+        print("no free player on", host)
+        return
+    info = client.welcome
+    vg.World.width, vg.World.height = info["width"], info["height"]
+    screen = pygame.display.set_mode((info["width"], info["height"]))
+    pygame.display.set_caption("vectorgame: {} player on {}".format(info["names"][info["player"]], host))
+    images = [vg.assets.picture(c) for c in info["colors"]]
+    particles = vg.ParticleSystem()
+    clock = pygame.time.Clock()
+    while client.running:
+        seconds = clock.tick(60) / 1000
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                client.running = False
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_HOME:
+                switches[0] |= vg.SWITCH_AIMING
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_END:
+                switches[0] |= vg.SWITCH_TARGET
+        draw(client, screen, particles, images, seconds)
+        pygame.display.flip()
+        await asyncio.sleep(0) # let the client send and receive
+    await task
+    transport.close()
+    pygame.quit()
+
+
+async def serve(port, players, bots, seed, snapshot_every):
+    vg.init_headless()
+    world = vg.World(1024, 800, seed, players=players, bots=bots)
+    loop = asyncio.get_running_loop()
+    transport, server = await loop.create_datagram_endpoint(lambda: Server(world, snapshot_every),
+                                                            local_addr=("0.0.0.0", port))
+    print("server on port {}: {} players, {} bots".format(port, players, bots))
+    try:
+        while True:
+            await server.run(10)
+            stats = server.stats()
+            print("{} clients, {:.0f} bytes per snapshot, {:.0f} us encoding".format(
+                  stats["clients"], stats["packet_bytes_mean"], stats["encode_us"]))
+    finally:
+        transport.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="network multiplayer for vectorgame")
+    parser.add_argument("--serve", action="store_true", help="run a server")
+    parser.add_argument("--connect", metavar="HOST[:PORT]", help="play on a server")
+    parser.add_argument("--loopback", action="store_true",
+                        help="server and test clients in this process, with simulated latency and packet loss")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--bots", type=int, default=0)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--snapshot-every", type=int, default=3, help="ticks between two snapshots")
+    parser.add_argument("--clients", type=int, default=3, help="--loopback: number of test clients")
+    parser.add_argument("--seconds", type=float, default=10, help="--loopback: duration")
+    parser.add_argument("--latency", type=float, default=50, help="--loopback: one way latency in milliseconds")
+    parser.add_argument("--jitter", type=float, default=10, help="--loopback: latency +- milliseconds")
+    parser.add_argument("--loss", type=float, default=0.05, help="--loopback: part of the packets that get lost")
+    args = parser.parse_args()
+    if args.serve:
+        asyncio.run(serve(args.port, args.players, args.bots, args.seed, args.snapshot_every))
+    elif args.connect:
+        host, _, port = args.connect.partition(":")
+        asyncio.run(play(host, int(port or args.port)))
+    elif args.loopback:
+        os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+        result = asyncio.run(loopback(args.clients, args.seconds, args.latency / 1000, args.jitter / 1000, args.loss,
+                                      args.players, args.bots, 1 if args.seed is None else args.seed,
+                                      args.snapshot_every))
+        s = result["server"]
+        print("server: {} ticks, {} snapshots, {:.0f} us encoding, packets {:.0f} bytes (p95 {}, max {}), "
+              "{} malformed inputs".format(s["ticks"], s["snapshots"], s["encode_us"], s["packet_bytes_mean"],
+                                           s["packet_bytes_p95"], s["packet_bytes_max"], s["malformed"]))
+        for c in result["clients"]:
+            print("client of player {}: {} snapshots ({} undecodable), down {:.0f} B/s, up {:.0f} B/s, "
+                  "{:.0f} us decoding, latency {:.0f} ms (p95 {:.0f} ms)".format(
+                  c["player"], c["snapshots"], c["undecodable"], c["down_bytes_per_second"],
+                  c["up_bytes_per_second"], c["decode_us"], c["latency_ms_mean"], c["latency_ms_p95"]))
+        print("lost packets:", result["lost_packets"])
+    else:
+        parser.print_help()
@@ -0,0 +1,328 @@
+"""simulation and drawing in two processes for vectorgame_clean.py.
+   A worker process runs the World (movement, beams, bubbles, collision) and
+   publishes the state of each tick into shared memory: a triple buffer of
+   numpy arrays (players, beams, particles). The window process draws the
+   newest published state directly from the shared arrays, without copying,
+   and never waits for the simulation: only the swap of two slot numbers
+   is done under a lock. Needs numpy, beams and bubbles are always arrays.
+   usage: python3 vectorgame_clean.py --split
+          python3 sharedworld.py --benchmark [--seconds 5] [--players 16 --bots 16]"""
+
+import os
+import time
+import queue
+import argparse
+import multiprocessing
+from multiprocessing import shared_memory
+
+import pygame
+import numpy as np
+import vectorgame_clean as vg
+
+# columns of the player array
+PLAYER_FIELDS = ("x", "y", "angle", "cannon_angle", "hitpoints", "hitpointsfull", "aiming", "target", "color")
+BEAM_FIELDS = ("x", "y", "angle", "owner")
+PARTICLE_FIELDS = ("x", "y", "radius", "color") # color: 0xRRGGBB
+HEADER_FIELDS = ("tick", "players", "beams", "particles", "step_ns")
+
+
+def pack_colors(colors):
+    """uint8 array (n, 3) -> 0xRRGGBB (exact in float32)"""
+    colors = colors.astype("int64")
+    return (colors[:, 0] << 16) | (colors[:, 1] << 8) | colors[:, 2]
+
+
+class SharedState():
+    """renderable state of a World in shared memory, in 3 slots (triple buffer):
+       the simulation fills the back slot and swaps it with the middle one (publish),
+       the window swaps the middle one with its front slot if there is a newer one
+       (acquire). Each side only touches its own slot, only the swaps take the lock.
+       name None: create the shared memory, else attach to it"""
+
+    def __init__(self, players, max_beams=8192, max_particles=32768, name=None, lock=None):
+        self.max_players, self.max_beams, self.max_particles = players, max_beams, max_particles
+        shapes = {"header": ((len(HEADER_FIELDS),), "int64"),
+                  "players": ((players, len(PLAYER_FIELDS)), "float32"),
+                  "beams": ((max_beams, len(BEAM_FIELDS)), "float32"),
+                  "particles": ((max_particles, len(PARTICLE_FIELDS)), "float32")}
+        slot_size = sum(np.dtype(dtype).itemsize * int(np.prod(shape)) for shape, dtype in shapes.values())
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=32 + 3 * slot_size)
+        self.name = self.shm.name
+        self.lock = lock if lock is not None else multiprocessing.Lock()
+        self.indices = np.ndarray((4,), "int64", self.shm.buf, 0) # front, middle, back, middle is new
+        if name is None:
+            self.indices[:] = (0, 1, 2, 0)
+        self.slots = []
+        offset = 32
+        for _ in range(3):
+            slot = {}
+            for key, (shape, dtype) in shapes.items():
+                slot[key] = np.ndarray(shape, dtype, self.shm.buf, offset)
+                offset += slot[key].nbytes
+            if name is None:
+                slot["header"][:] = 0
+            self.slots.append(slot)
+
+    def publish(self, world, step_ns=0):
+        """write the state of world into the back slot and make it the newest"""
+        slot = self.slots[self.indices[2]] # the back slot belongs to the simulation
+        players = slot["players"]
+        for nr, p in enumerate(world.playergroup):
+            target = 0 if p.target == "nearest" else vg.World.player_names[p.target].playernumber + 1
+            players[nr] = (p.pos.x, p.pos.y, p.angle % 360, p.cannon_angle % 360, p.hitpoints, p.hitpointsfull,
+                           vg.Player.aimings.index(p.aiming), target, (p.color[0] << 16) | (p.color[1] << 8) | p.color[2])
+        beams = world.beams
+        b = min(beams.count, self.max_beams)
+        slot["beams"][:b, 0:2] = beams.pos[:b]
+        slot["beams"][:b, 2] = beams.angle[:b]
+        slot["beams"][:b, 3] = beams.owner[:b]
+        particles = world.particles
+        n = min(particles.count, self.max_particles)
+        slot["particles"][:n, 0:2] = particles.pos[:n]
+        slot["particles"][:n, 2] = particles.radius[:n]
+        slot["particles"][:n, 3] = pack_colors(particles.color[:n])
+        slot["header"][:] = (world.ticks, len(world.playergroup), b, n, step_ns)
+        with self.lock:
+            i = self.indices
+            i[1], i[2] = i[2], i[1]
+            i[3] = 1
+
+    def acquire(self):
+        """the newest published slot, it can be read until the next acquire()"""
+        with self.lock:
+            i = self.indices
+            if i[3]:
+                i[0], i[1] = i[1], i[0]
+                i[3] = 0
+        return self.slots[self.indices[0]] # the front slot belongs to the window
+
+    def close(self, unlink=False):
+        self.slots = self.indices = None # numpy views must be gone before close
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def simulate(name, players, max_beams, max_particles, lock, commands, stop, width, height, seed, bots, realtime):
+    """the worker process: steps the World with its tickrate (or as fast as possible if
+       not realtime) and publishes each tick. commands is a queue of ([Command, ...], keys)
+       from the window: turn, thrust and aim stay until the next message,
+       switches and keys are used once"""
+    vg.init_headless()
+    world = vg.World(width, height, seed, players=players, bots=bots)
+    state = SharedState(players, max_beams, max_particles, name=name, lock=lock)
+    current = None # newest commands
+    dt = world.dt
+    next_time = time.perf_counter()
+    while not stop.is_set():
+        switches = [0] * players
+        keys = 0
+        while True:
+            try:
+                current, new_keys = commands.get_nowait()
+            except queue.Empty:
+                break
+            keys |= new_keys
+            for nr, command in enumerate(current):
+                switches[nr] |= command.switches
+        step_commands = None if current is None else [c._replace(switches=s) for c, s in zip(current, switches)]
+        start = time.perf_counter_ns()
+        world.step(dt, step_commands, keys)
+        state.publish(world, time.perf_counter_ns() - start)
+        if realtime:
+            next_time += dt
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -0.25:
+                next_time = time.perf_counter() # too slow, do not catch up
+    state.close()
+
+
+class Renderer():
+    """draws a slot of SharedState: bubbles, beams, players with crosshair and hud"""
+
+    def __init__(self, screen):
+        self.screen = screen
+        self.stamps = {} # 0xRRGGBB + radius << 24: circle image
+        self.stamp_maker = vg.ParticleSystem(capacity=1)
+
+    def stamp(self, key):
+        image = self.stamps.get(key)
+        if image is None:
+            radius, color = key >> 24, ((key >> 16) & 255, (key >> 8) & 255, key & 255)
+            image = self.stamp_maker.stamps[self.stamp_maker.get_stamp(radius, color)]
+            self.stamps[key] = image
+        return image
+
+    def draw(self, slot):
+        screen = self.screen
+        screen.fill((255, 255, 255))
+        tick, players, beams, particles, step_ns = slot["header"].tolist()
+        # ---- bubbles ----
+        p = slot["particles"][:particles]
+        if particles:
+            radius = p[:, 2].astype("int64")
+            keys = (radius << 24) | p[:, 3].astype("int64")
+            unique_keys, inverse = np.unique(keys, return_inverse=True)
+            images = [self.stamp(k) for k in unique_keys.tolist()]
+            xs = (p[:, 0] - radius).tolist()
+            ys = (p[:, 1] - radius).tolist()
+            screen.blits([(images[i], (x, y)) for i, x, y in zip(inverse.reshape(-1).tolist(), xs, ys)], doreturn=False)
+        # ---- players ----
+        rows = slot["players"][:players].tolist()
+        colors = [(int(r[8]) >> 16, (int(r[8]) >> 8) & 255, int(r[8]) & 255) for r in rows]
+        for row, color in zip(rows, colors):
+            if row[4] <= 0:
+                continue # game over
+            image = vg.rotation_cache.get(vg.assets.picture(color), row[2])
+            screen.blit(image, image.get_rect(center=(round(row[0]), round(row[1]))))
+            v = pygame.math.Vector2(85, 0)
+            v.rotate_ip(row[3])
+            pygame.draw.circle(screen, color, (round(row[0] + v.x), round(row[1] + v.y)), 10, 1)
+        # ---- beams ----
+        screen.blits([(image, image.get_rect(center=(round(x), round(y)))) for image, x, y in
+                      ((vg.rotation_cache.get(vg.beam_image(colors[int(owner)]), angle), x, y)
+                       for x, y, angle, owner in slot["beams"][:beams].tolist())], doreturn=False)
+        # ---- hud ----
+        length = vg.World.width // max(1, players)
+        for nr, (row, color) in enumerate(zip(rows, colors)):
+            percent = max(0, row[4]) / row[5]
+            pygame.draw.rect(screen, color, (nr * length + 1, 1, int(length * percent) - 2, vg.World.hud_height - 1))
+            pygame.draw.rect(screen, (0, 0, 0), (nr * length, 0, length, vg.World.hud_height), 1)
+        return tick, step_ns
+
+
+class SplitViewer():
+    """window in this process, simulation in a worker process (see simulate()).
+       Input is sampled each frame and sent to the worker, the newest published
+       state is drawn, the window never waits for the simulation"""
+
+    def __init__(self, width=1024, height=800, seed=None, players=4, bots=0,
+                 max_beams=8192, max_particles=32768, realtime=True):
+        pygame.display.init() # no mixer, see Viewer
+        pygame.font.init()
+        self.joysticks = vg.init_joysticks()
+        vg.World.width, vg.World.height = width, height
+        self.screen = pygame.display.set_mode((width, height), pygame.DOUBLEBUF)
+        self.clock = pygame.time.Clock()
+        self.fps = 60
+        self.players = players
+        self.input = vg.InputSampler(self.joysticks, players)
+        self.renderer = Renderer(self.screen)
+        context = multiprocessing.get_context("spawn") # no fork of an initialized SDL
+        self.state = SharedState(players, max_beams, max_particles, lock=context.Lock())
+        self.commands = context.Queue()
+        self.stop = context.Event()
+        self.worker = context.Process(target=simulate, name="simulation",
+                                      args=(self.state.name, players, max_beams, max_particles, self.state.lock,
+                                            self.commands, self.stop, width, height, seed, bots, realtime))
+        self.worker.start()
+        self.frames = 0
+        self.draw_ns = 0 # sum of drawing times
+
+    def frame(self, switches=None, keys=0):
+        """send the input, draw the newest state and flip. Returns the tick of the drawn state"""
+        commands = self.input.sample()
+        if switches:
+            commands = [c._replace(switches=c.switches | s) for c, s in zip(commands, switches)]
+        self.commands.put((commands, keys))
+        start = time.perf_counter_ns()
+        tick, step_ns = self.renderer.draw(self.state.acquire())
+        vg.write(self.screen, "FPS: {:6.1f}  tick {}  step {:.2f} ms".format(self.clock.get_fps(), tick, step_ns / 1e6),
+                 origin="bottomright", x=vg.World.width - 5, y=vg.World.height - 5, font_size=18, color=(200, 40, 40))
+        pygame.display.flip()
+        self.draw_ns += time.perf_counter_ns() - start
+        self.frames += 1
+        return tick
+
+    def run(self):
+        pygame.display.set_caption("vectorgame: simulation in a worker process")
+        running = True
+        while running:
+            self.clock.tick(self.fps)
+            switches = [0] * self.players
+            keys = 0
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_ESCAPE:
+                        running = False
+                    elif event.key == pygame.K_HOME and switches:
+                        switches[0] |= vg.SWITCH_AIMING
+                    elif event.key == pygame.K_END and switches:
+                        switches[0] |= vg.SWITCH_TARGET
+                    elif event.key == pygame.K_r:
+                        keys |= vg.KEY_RESET
+                    elif event.key == pygame.K_x:
+                        keys |= vg.KEY_TEST
+                elif event.type == pygame.JOYBUTTONUP:
+                    found = self.input.switch(event)
+                    if found:
+                        number, bits = found
+                        switches[number] |= bits
+            self.frame(switches, keys)
+        print("{} frames, {:.2f} ms drawing per frame".format(self.frames, self.draw_ns / max(1, self.frames) / 1e6))
+        self.close()
+
+    def close(self):
+        self.stop.set()
+        self.worker.join()
+        self.state.close(unlink=True)
+        pygame.quit()
+
+
+def benchmark(seconds=5.0, players=16, bots=16, seed=1):
+    """frames per second with simulation and drawing in one process (2 ticks and one
+       draw per frame) and split into two processes (simulation as fast as possible)"""
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    # ---- one process ----
+    vg.init_headless()
+    screen = pygame.display.set_mode((1024, 800))
+    world = vg.World(1024, 800, seed, players=players, bots=bots)
+    state = SharedState(players)
+    renderer = Renderer(screen)
+    frames = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for _ in range(2):
+            world.step(world.dt)
+        state.publish(world)
+        renderer.draw(state.acquire())
+        frames += 1
+    single = {"frames_per_second": frames / seconds, "ticks_per_second": world.ticks / seconds}
+    state.close(unlink=True)
+    pygame.quit()
+    # ---- two processes ----
+    viewer = SplitViewer(1024, 800, seed, players, bots, realtime=False)
+    start = time.perf_counter()
+    first_tick = None
+    while time.perf_counter() - start < seconds:
+        pygame.event.pump()
+        tick = viewer.frame()
+        if first_tick is None and tick > 0:
+            first_tick, first_time = tick, time.perf_counter()
+    ticks = tick - (first_tick or 0)
+    split = {"frames_per_second": viewer.frames / seconds,
+             "ticks_per_second": ticks / max(1e-9, time.perf_counter() - first_time) if first_tick else 0.0}
+    viewer.close()
+    return {"single": single, "split": split}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="simulation in a worker process, drawing from shared memory")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="compare frames and ticks per second with one and with two processes")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--players", type=int, default=16)
+    parser.add_argument("--bots", type=int, default=16)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    if args.benchmark:
+        result = benchmark(args.seconds, args.players, args.bots, 1 if args.seed is None else args.seed)
+        for mode in ("single", "split"):
+            print("{:>6}: {:8.1f} frames per second, {:8.1f} ticks per second".format(
+                  mode, result[mode]["frames_per_second"], result[mode]["ticks_per_second"]))
+    else:
+        SplitViewer(seed=args.seed, players=args.players, bots=args.bots).run()
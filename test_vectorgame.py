@@ -0,0 +1,180 @@
+"""tests for vectorgame_clean.py, headless (SDL dummy video driver).
+   usage: python3 -m pytest test_vectorgame.py"""
+
+import os
+import random
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+import pytest
+import vectorgame_clean as vg
+
+
+def test_beam_of_non_player_boss_hits_player():
+    """a Beam sprite whose boss is not a Player damages a player without counting hits"""
+    vg.init_headless()
+    world = vg.World(800, 600, seed=1, particles=False, beams=False, players=2)
+    player = world.playergroup.sprites()[0]
+    boss = vg.VectorSprite(pos=pygame.math.Vector2(700, 500), color=(255, 0, 0))
+    beam = vg.Beam(pos=pygame.math.Vector2(player.pos.x, player.pos.y), move=pygame.math.Vector2(100, 0), boss=boss)
+    hitpoints = player.hitpoints
+    world.collision()
+    assert player.hitpoints == hitpoints - beam.damage
+    assert not beam.alive()
+    assert sum(p.hits for p in world.playergroup) == 0
+
+
+def play(seed, particles, level, ticks=2400):
+    """a bot match at a fixed quality level, returns the state of the players and the number of bubbles"""
+    vg.init_headless()
+    world = vg.World(800, 600, seed=seed, particles=particles, beams=particles, players=4, bots=4)
+    governor = vg.QualityGovernor()
+    governor.level = level
+    governor.apply(world)
+    pool = vg.Bubble.pool
+    created = pool.allocations + pool.reuses
+    try:
+        for _ in range(ticks):
+            world.step(world.dt)
+    finally:
+        governor.level = 0
+        governor.apply(world) # Crosshair and rotation_cache are shared
+    players = [(p.hitpoints, p.hits, round(p.pos.x, 6), round(p.pos.y, 6)) for p in world.playergroup]
+    if world.particles is not None:
+        bubbles = world.particles.burst_count
+    else:
+        bubbles = pool.allocations + pool.reuses - created
+    return players, bubbles
+
+
+@pytest.mark.parametrize("particles", [False, True], ids=["sprites", "arrays"])
+def test_same_seed_same_match_at_all_quality_levels(particles):
+    """the QualityGovernor changes only the bubbles, never the match"""
+    full, full_bubbles = play(5, particles, 0)
+    low, low_bubbles = play(5, particles, len(vg.QualityGovernor.levels) - 1)
+    assert low_bubbles < full_bubbles # the levels did change something
+    assert sum(hits for hitpoints, hits, x, y in full) > 0
+    assert low == full
+
+
+def record(filename, frames=200, seed=7):
+    """a recorded match of 2 players (one bot) with random input, returns the state of the players"""
+    vg.init_headless()
+    world = vg.World(800, 600, seed=seed, particles=False, beams=False, players=2, bots=1)
+    recorder = vg.InputRecorder(filename, world)
+    rng = random.Random(seed)
+    for frame in range(frames):
+        for _ in range(2):
+            commands = [vg.Command(rng.uniform(-1, 1), rng.uniform(-1, 1), rng.uniform(-1, 1),
+                                   rng.choice((0, 0, vg.SWITCH_AIMING, vg.SWITCH_TARGET))) for p in range(2)]
+            world.step(world.dt, recorder.step(0, commands))
+        recorder.end_frame(16)
+    recorder.close()
+    return world.ticks, [(p.hitpoints, p.aiming, p.target, p.pos.x, p.pos.y, p.angle) for p in world.playergroup]
+
+
+def test_record_replay_round_trip(tmp_path):
+    filename = str(tmp_path / "match.rec")
+    ticks, players = record(filename)
+    world, times = vg.replay(filename)
+    assert len(times) == 200
+    assert world.ticks == ticks
+    assert [(p.hitpoints, p.aiming, p.target, p.pos.x, p.pos.y, p.angle) for p in world.playergroup] == players
+
+
+def test_truncated_recording_gives_complete_frames(tmp_path):
+    """a game killed while recording leaves a gzip stream without end"""
+    filename = str(tmp_path / "match.rec")
+    record(filename, frames=2000)
+    with open(filename, "rb") as f:
+        data = f.read()
+    with open(filename, "wb") as f:
+        f.write(data[:len(data) // 2])
+    header, frames = vg.read_recording(filename)
+    assert header["players"] == 2
+    assert 0 < len(frames) < 2000
+    assert all(len(steps) == 2 for milliseconds, steps in frames)
+
+
+class FakeJoystick():
+    def __init__(self, instance_id):
+        self.instance_id = instance_id
+
+    def get_instance_id(self):
+        return self.instance_id
+
+    def get_numbuttons(self):
+        return 8
+
+
+def test_joystick_switches_come_from_button_up_events():
+    """a tap is down and up before the next sample, the JOYBUTTONUP event still gives the switch"""
+    sampler = vg.InputSampler([FakeJoystick(7), FakeJoystick(9)], players=2)
+    up = lambda instance_id, button: pygame.event.Event(pygame.JOYBUTTONUP, instance_id=instance_id, button=button)
+    assert sampler.switch(up(9, 0)) == (1, vg.SWITCH_AIMING)
+    assert sampler.switch(up(7, 7)) == (0, vg.SWITCH_TARGET)
+    assert sampler.switch(up(7, 2)) is None # an aim button
+    assert sampler.switch(up(3, 0)) is None # not the joystick of a player
+
+
+def test_snapshot_delta_round_trip():
+    """a snapshot encoded as difference to a baseline decodes to the same tables"""
+    pytest.importorskip("numpy")
+    import netplay
+    import numpy as np
+    vg.init_headless()
+    world = vg.World(800, 600, seed=3, players=4, bots=4)
+    for _ in range(240):
+        world.step(world.dt)
+    base = (netplay.quantize_players(world), netplay.quantize_beams(world.beams))
+    for _ in range(30):
+        world.step(world.dt)
+    snapshot = (netplay.quantize_players(world), netplay.quantize_beams(world.beams))
+    bursts = [(100.0, 200.0, (255, 0, 0), 1), (5.0, 6.0, (0, 255, 0), 3)]
+    for baseline in (None, base):
+        (players, beams), decoded_bursts = netplay.decode_snapshot(
+            netplay.encode_snapshot(snapshot, baseline, bursts), baseline)
+        for decoded, table in ((players, snapshot[0]), (beams, snapshot[1])):
+            assert np.array_equal(decoded[0], table[0])
+            assert np.array_equal(decoded[1], table[1])
+        assert decoded_bursts == [(100, 200, (255, 0, 0), 1), (5, 6, (0, 255, 0), 3)]
+    assert len(snapshot[1][0]) > 0 # there were beams to encode
+
+
+def test_corrupt_snapshots_are_dropped():
+    pytest.importorskip("numpy")
+    import netplay
+    import zlib
+    client = netplay.Client()
+    header = netplay.SNAPSHOT.pack(b"S", 5, 0, 1, 0)
+    for packet in (header + b"garbage", header + zlib.compress(b"\x07\x00"), b"S\x01"):
+        client.datagram_received(packet, ("server", 5555))
+    assert client.undecodable == 3
+    assert client.latest == 0
+
+
+@pytest.mark.parametrize("every", [1, 2, 3])
+def test_capture_decimates_and_drops_behind_blocked_encoder(tmp_path, every):
+    """with the encoder stuck, the ring fills to half, then every second frame is
+       taken until it is full, after that the frames are dropped"""
+    import threading
+    pygame.display.init()
+    screen = pygame.display.set_mode((64, 48))
+    capture = vg.FrameCapture(str(tmp_path / "frames"), screen, size=8, every=every, threads=1)
+    gate = threading.Event()
+    write_png = capture.write_png
+
+    def blocked_write_png(filename, surface):
+        gate.wait()
+        return write_png(filename, surface)
+    capture.write_png = blocked_write_png
+    for frame in range(20 * every):
+        capture.grab(screen)
+    # taken frames 1-5 fill the ring to 3 free slots, 6-12 alternate, 13-20 alternate with drops
+    assert (capture.captured, capture.decimated, capture.dropped) == (8, 8, 4)
+    gate.set()
+    capture.close()
+    assert capture.written == 8
+    assert len(list((tmp_path / "frames").iterdir())) == 8
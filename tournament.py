@@ -0,0 +1,145 @@
+"""bot tournaments for balancing: many headless matches of bots in a process pool.
+   Each worker creates pygame and one World once and restarts it for every match
+   (World.restart), with a fixed seed per match. Parameter grids set Player
+   attributes (reload_time, firespeed, turnspeed, damage, ...) for all players,
+   or only for player 1 with --challenger. Results are written as json lines
+   (one per match) as soon as a match is over, a summary goes to stderr.
+   usage: python3 tournament.py --grid reload_time=0.1,0.15,0.2 --grid damage=1,2
+                                --matches 20 --players 4 --out results.jsonl"""
+
+import os
+import sys
+import time
+import json
+import argparse
+import itertools
+import multiprocessing
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import vectorgame_clean as vg
+
+# Player attributes a grid may change
+PARAMETERS = ("reload_time", "firespeed", "turnspeed", "movespeed", "damage", "hitpoints", "cannon_turn_speed")
+
+world = None # the World of this worker process
+defaults = None # parameter values of a new Player
+
+
+def init_worker(players, width, height):
+    """once for each worker process: pygame without window and a World for all matches"""
+    global world, defaults
+    vg.init_headless()
+    world = vg.World(width, height, 0, players=players, bots=players)
+    p = world.playergroup.sprites()[0]
+    defaults = {name: getattr(p, name) for name in PARAMETERS}
+
+
+def play_match(task):
+    """one match of bots until one survivor (or a draw after max_seconds), returns a dict"""
+    number, params, seed, challenger, max_seconds = task
+    start = time.perf_counter()
+    world.restart(seed)
+    players = world.playergroup.sprites()
+    for p in players:
+        for name, value in dict(defaults, **params if not challenger or p.playernumber == 0 else {}).items():
+            setattr(p, name, value)
+        p.hitpointsfull = p.hitpoints
+    max_ticks = round(max_seconds / world.dt)
+    alive = players
+    while world.ticks < max_ticks and len(alive) > 1:
+        world.step(world.dt)
+        alive = [p for p in players if p.hitpoints > 0]
+    winner = alive[0] if len(alive) == 1 else None
+    return {"match": number, "params": params, "seed": seed,
+            "winner": winner.name if winner else None,
+            "winner_number": winner.playernumber if winner else None,
+            "duration": round(world.playtime, 3), "ticks": world.ticks,
+            "shots": [p.shots for p in players], "hits": [p.hits for p in players],
+            "hitpoints": [p.hitpoints for p in players],
+            "seconds": round(time.perf_counter() - start, 3), "worker": os.getpid()}
+
+
+def parse_grid(specs):
+    """['reload_time=0.1,0.2', 'damage=1,2'] -> list of dicts, the cartesian product"""
+    names, values = [], []
+    for spec in specs:
+        name, _, text = spec.partition("=")
+        if name not in PARAMETERS:
+            raise ValueError("unknown parameter {}, use one of {}".format(name, ", ".join(PARAMETERS)))
+        names.append(name)
+        values.append([int(v) if v.strip().lstrip("-").isdigit() else float(v) for v in text.split(",")])
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def run(grid, matches=10, players=4, seed=1, challenger=False, max_seconds=300.0, processes=None,
+        width=1024, height=800, out=sys.stdout):
+    """play matches for each parameter set of grid, match number i gets the seed seed + i
+       (the same seeds for each parameter set). Returns the list of results"""
+    processes = processes or os.cpu_count() or 1
+    tasks = [(n * matches + i, params, seed + i, challenger, max_seconds)
+             for n, params in enumerate(grid) for i in range(matches)]
+    results = []
+    start = time.perf_counter()
+    pool = multiprocessing.Pool(processes, init_worker, (players, width, height))
+    for result in pool.imap_unordered(play_match, tasks):
+        out.write(json.dumps(result) + "\n")
+        out.flush()
+        results.append(result)
+    # no pool.terminate(): SDL catches SIGTERM in the workers, they stop when the task queue is closed
+    pool.close()
+    pool.join()
+    seconds = time.perf_counter() - start
+    print("{} matches in {:.1f} s with {} processes: {:.3f} matches per second, {:.3f} per core".format(
+          len(results), seconds, processes, len(results) / seconds, len(results) / seconds / processes),
+          file=sys.stderr)
+    return results
+
+
+def summary(results, challenger=False):
+    """wins, draws, mean duration and hit rate for each parameter set"""
+    table = {}
+    for r in results:
+        row = table.setdefault(json.dumps(r["params"], sort_keys=True),
+                               {"matches": 0, "wins": {}, "draws": 0, "duration": 0.0, "shots": 0, "hits": 0})
+        row["matches"] += 1
+        if r["winner"] is None:
+            row["draws"] += 1
+        else:
+            row["wins"][r["winner"]] = row["wins"].get(r["winner"], 0) + 1
+        row["duration"] += r["duration"]
+        shots, hits = (r["shots"][:1], r["hits"][:1]) if challenger else (r["shots"], r["hits"])
+        row["shots"] += sum(shots)
+        row["hits"] += sum(hits)
+    for params, row in sorted(table.items()):
+        print("{}: {} matches, wins {}, draws {}, {:.1f} s per match, hit rate {:.1%}".format(
+              params, row["matches"], row["wins"], row["draws"], row["duration"] / row["matches"],
+              row["hits"] / max(1, row["shots"])), file=sys.stderr)
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="headless bot tournaments in a process pool")
+    parser.add_argument("--grid", action="append", default=[], metavar="NAME=V1,V2,...",
+                        help="values of a Player attribute ({}), can be given more than once".format(", ".join(PARAMETERS)))
+    parser.add_argument("--matches", type=int, default=10, help="matches for each parameter set")
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=1, help="seed of the first match, the next ones get seed+1, ...")
+    parser.add_argument("--challenger", action="store_true",
+                        help="the grid changes only player 1, the others keep the default values")
+    parser.add_argument("--max-seconds", type=float, default=300, help="game time until a match is a draw")
+    parser.add_argument("--processes", type=int, help="worker processes, default: number of cores")
+    parser.add_argument("--out", metavar="FILE", help="json lines file, default: stdout")
+    args = parser.parse_args()
+    if args.players < 1:
+        parser.error("--players must be at least 1")
+    grid = parse_grid(args.grid) or [{}]
+    out = open(args.out, "w") if args.out else sys.stdout
+    try:
+        results = run(grid, args.matches, args.players, args.seed, args.challenger, args.max_seconds,
+                      args.processes, out=out)
+    finally:
+        if args.out:
+            out.close()
+    summary(results, args.challenger)
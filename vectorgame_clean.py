@@ -1,24 +1,386 @@
 """2d vector game in pure python3 / pygame, no external files necessary.
    create beautiful patterns by steering your spaceships with keyboard or
-   joysticks (joysticks recommended. 4 players maximum"""
+   joysticks (joysticks recommended). 4 players, or more with --players and --bots"""
 
+import time
+launch_time = time.perf_counter() # start of the startup report, see StartupTimer
 import pygame
 import random
+try:
+    import numpy as np
+except ImportError:
+    np = None # no ParticleSystem, Bubble sprites are used instead
+import collections
+import os
+import sys
+import glob
+import json
+import argparse
+import struct
+import threading
+import gzip
+import queue
+import zlib
+import weakref
 
 # patterns for player spaceship
 
 def create_picture(color=(0, 0, 255), size=35):
-    # create 1 pictures of a spaceship, pointing to right
+    # create 1 pictures of a spaceship, pointing to right. Use assets.picture() for a converted, shared one
     pic = pygame.Surface((size, size))
     pygame.draw.polygon(pic, color, [(0, 0), (size, size // 2), (0, size), (size // 3, size // 2)])
     pic.set_colorkey((0, 0, 0))
-    pic.convert_alpha()
     return pic
 
 def validcolor(colorvalue):
     """makes sure a value remains between 0 and 255"""
     return 0 if colorvalue < 0 else 255 if colorvalue > 255 else colorvalue
 
+# font registry and cache for rendered text
+
+class FontPaths():
+    """file paths of system fonts, cached on disk as json. pygame.font.SysFont
+       scans all system fonts for the first font (fc-list on linux), which takes
+       hundreds of milliseconds, loading a font file by its path does not.
+       An entry is stale if its font file changed, the whole cache is stale if the
+       pygame version or a font folder (or one of its subfolders) changed.
+       A cache that can not be written (read only home) only costs the scan"""
+    folders = ("/usr/share/fonts", "/usr/local/share/fonts", "~/.fonts", "~/.local/share/fonts",
+               "/Library/Fonts", "/System/Library/Fonts", "~/Library/Fonts", "C:/Windows/Fonts")
+
+    def __init__(self, filename=None):
+        cache = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        self.filename = filename or os.path.join(cache, "vectorgame", "fonts.json")
+        self.paths = None # { "name,bold": [path or None, fake bold, mtime of the path] }, loaded by the first resolve()
+        self.version = None # fingerprint of pygame and the font folders
+        self.hits = 0
+        self.misses = 0 # SysFont scans
+        self.stale = 0 # entries or whole caches thrown away
+
+    def fingerprint(self):
+        """pygame version, number and newest modification time of all font folders"""
+        count, newest = 0, 0.0
+        for folder in self.folders:
+            for path, dirs, files in os.walk(os.path.expanduser(folder)):
+                count += 1
+                newest = max(newest, self.mtime(path))
+        return [pygame.version.ver, count, newest]
+
+    def mtime(self, path):
+        try:
+            return os.stat(path).st_mtime
+        except (OSError, TypeError):
+            return None
+
+    def load(self):
+        self.paths = {}
+        self.version = self.fingerprint()
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != self.version:
+            self.stale += 1
+            return
+        self.paths = data.get("paths", {})
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            with open(self.filename + ".tmp", "w") as f:
+                json.dump({"version": self.version, "paths": self.paths}, f, indent=1)
+            os.replace(self.filename + ".tmp", self.filename)
+        except OSError:
+            pass
+
+    def resolve(self, font_name="mono", bold=True):
+        """returns (path, fake_bold) like SysFont would use them: the font file, None
+           for the default font of pygame, and if bold has to be faked (no bold file)"""
+        if self.paths is None:
+            self.load()
+        key = "{},{}".format(font_name, int(bold))
+        entry = self.paths.get(key)
+        if entry is not None:
+            path, fake_bold, mtime = entry
+            if path is None or self.mtime(path) == mtime:
+                self.hits += 1
+                return path, fake_bold
+            self.stale += 1
+        self.misses += 1
+        # SysFont does the search, the constructor only returns what it found
+        path, fake_bold = pygame.font.SysFont(font_name, 0, bold, constructor=lambda path, size, bold, italic: (path, bold))
+        self.paths[key] = [path, fake_bold, self.mtime(path)]
+        self.save()
+        return path, fake_bold
+
+    def stats(self):
+        return "{} hits, {} scans, {} stale".format(self.hits, self.misses, self.stale)
+
+font_paths = FontPaths()
+fonts = {} # { (font_name, font_size, bold): pygame.font.Font }
+
+def get_font(font_name="mono", font_size=24, bold=True):
+    """returns a pygame font, loaded only once for each (font_name, font_size, bold).
+       The font file is found with font_paths instead of SysFont"""
+    key = (font_name, font_size, bold)
+    font = fonts.get(key)
+    if font is None:
+        path, fake_bold = font_paths.resolve(font_name, bold)
+        font = pygame.font.Font(path, font_size)
+        font.set_bold(fake_bold)
+        fonts[key] = font
+    return font
+
+
+class TextCache():
+    """bounded LRU cache of rendered text surfaces.
+       Never draw on a surface returned from the cache, it is shared"""
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.surfaces = collections.OrderedDict() # { (text, color, size, font_name, bold): surface }
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text, color, font_size, font_name="mono", bold=True):
+        key = (text, tuple(color), font_size, font_name, bold)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+        self.misses += 1
+        surface = get_font(font_name, font_size, bold).render(text, True, color)
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert_alpha() # pygame surface, use for blitting
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False) # remove least recently used text
+        return surface
+
+    def clear(self):
+        self.surfaces.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """returns a dict with hits, misses, hit ratio and number of cached surfaces"""
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "ratio": self.hits / total if total > 0 else 0.0,
+                "size": len(self.surfaces)}
+
+text_cache = TextCache()
+
+
+class RotationCache():
+    """rotated copies of source images, shared by all sprites.
+       The angle is rounded to 'step' degrees, so turning a sprite costs
+       only a dict lookup once the rotated image exists.
+       Never draw on a surface returned from the cache, it is shared"""
+
+    def __init__(self, step=1):
+        self.step = step
+        self.images = {} # { (source image, angle in degrees): rotated image }
+        self.hits = 0
+        self.misses = 0
+
+    def set_step(self, step, clear=True):
+        """change the angle quantization (in degrees), drops all cached images if clear.
+           Without clear a coarser step (a multiple of the old one) only uses images
+           that are already cached, it needs no new rotations"""
+        self.step = step
+        if clear:
+            self.clear()
+
+    def get(self, image, angle):
+        """returns image rotated by angle (clockwise, in degrees, like VectorSprite.angle)"""
+        steps = round(360 / self.step)
+        index = round(angle / self.step) % steps
+        key = (image, index * self.step)
+        rotated = self.images.get(key)
+        if rotated is not None:
+            self.hits += 1
+            return rotated
+        self.misses += 1
+        rotated = pygame.transform.rotate(image, -index * self.step)
+        self.images[key] = rotated
+        return rotated
+
+    def prewarm(self, image):
+        """rotate image into every angle step, to avoid rotating while playing.
+           Does not count as hits or misses"""
+        hits, misses = self.hits, self.misses
+        for index in range(round(360 / self.step)):
+            self.get(image, index * self.step)
+        self.hits, self.misses = hits, misses
+
+    def clear(self):
+        self.images.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """returns a dict with hits, misses, hit ratio and number of cached images"""
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "ratio": self.hits / total if total > 0 else 0.0,
+                "size": len(self.images)}
+
+rotation_cache = RotationCache()
+
+
+class Assets():
+    """all generated and loaded images in the pixel format of the display, because
+       SDL blits those without converting each pixel. Images with hard edges get a
+       colorkey (black is transparent), per pixel alpha is only kept where an image
+       has it (text): a per pixel alpha blit is about 8 times slower than a colorkey blit.
+       Player pictures, beam and crosshair images are cached per color.
+       Background images of the folder 'data' are loaded and scaled in a thread.
+       check() counts blits of images that take a slow path"""
+
+    def __init__(self):
+        self.pictures = {} # { (color, size): player picture }
+        self.beams = {} # { color: unrotated beam image }, source images for rotation_cache
+        self.crosshairs = {} # { (color, simple): crosshair image }
+        self.backgrounds = [] # scaled, not yet converted background images from the loader thread
+        self.loader = None
+        self.converted = 0 # images converted to the display format
+        self.fast = weakref.WeakKeyDictionary() # { surface: True if blitting it is fast }
+        self.display = None # display surface of self.format
+        self.format = None # (bits per pixel, red, green and blue masks) of the display
+        self.blits = 0 # blits counted by check()
+        self.slow_blits = 0
+
+    def prepare(self, surface, colorkey=None, rle=True):
+        """returns surface in the display format. colorkey: transparent color, for hard edged
+           images (run length encoded if rle, only for images that are never drawn on again).
+           Without colorkey per pixel alpha is kept if surface has it, else surface is opaque.
+           Without display the surface is returned unchanged"""
+        if pygame.display.get_surface() is None:
+            if colorkey is not None:
+                surface.set_colorkey(colorkey)
+            return surface
+        if colorkey is not None:
+            surface = surface.convert()
+            surface.set_colorkey(colorkey, pygame.RLEACCEL if rle else 0)
+        elif surface.get_flags() & pygame.SRCALPHA:
+            surface = surface.convert_alpha()
+        else:
+            surface = surface.convert()
+        self.converted += 1
+        return surface
+
+    def picture(self, color, size=35):
+        """shared spaceship picture of create_picture(), do not draw on it"""
+        key = (tuple(color), size)
+        picture = self.pictures.get(key)
+        if picture is None:
+            picture = self.pictures[key] = self.prepare(create_picture(color, size), (0, 0, 0))
+        return picture
+
+    def beam(self, color):
+        """shared unrotated image of a laser beam, do not draw on it"""
+        color = tuple(color)
+        image = self.beams.get(color)
+        if image is None:
+            image = pygame.Surface((20, 20))
+            pygame.draw.line(image, color, (0, 10), (20, 10), 3)
+            #pygame.draw.line(image, (255,255,255), (2, 10), (18, 10), 1)
+            image = self.beams[color] = self.prepare(image, (0, 0, 0))
+        return image
+
+    def crosshair(self, color, simple=False):
+        """shared crosshair image, do not draw on it. simple: a small cross only"""
+        key = (tuple(color), simple)
+        image = self.crosshairs.get(key)
+        if image is None:
+            if simple:
+                image = pygame.Surface((11, 11))
+                pygame.draw.line(image, color, (0, 5), (10, 5), 1)
+                pygame.draw.line(image, color, (5, 0), (5, 10), 1)
+                pygame.draw.circle(image, (0, 0, 0), (5, 5), 1, 0) # hole
+            else:
+                image = pygame.Surface((30,30))
+                pygame.draw.line(image, color, (0,0), (30,30),1)
+                pygame.draw.line(image, color, (30, 0), (0, 30), 1)
+                pygame.draw.circle(image, (10,10,10), (15,15), 15, 1)
+                pygame.draw.circle(image, color, (15, 15), 10, 1)
+                pygame.draw.circle(image, (10, 10, 10), (15, 15), 5, 1)
+                pygame.draw.circle(image, (0, 0, 0), (15, 15), 2, 0)  # black -> transparent. makes a hole
+            image = self.crosshairs[key] = self.prepare(image, (0, 0, 0))
+        return image
+
+    def preload_backgrounds(self, folder, size):
+        """start a thread that loads every .jpg file below folder, scaled to size,
+           into self.backgrounds (in random order). Convert them with background()"""
+        self.loader = threading.Thread(target=self._load_backgrounds, args=(folder, size),
+                                       name="backgrounds", daemon=True)
+        self.loader.start()
+
+    def _load_backgrounds(self, folder, size):
+        filenames = []
+        for root, dirs, files in os.walk(folder):
+            for file in files:
+                if file[-4:].lower() == ".jpg" or file[-5:].lower() == ".jpeg":
+                    filenames.append(os.path.join(root, file))
+        if not filenames:
+            print("no folder '{}' or no jpg files in it".format(folder))
+        random.shuffle(filenames)  # remix sort order
+        for filename in filenames:
+            try:
+                image = pygame.transform.smoothscale(pygame.image.load(filename), size)
+            except (pygame.error, ValueError) as error:
+                print("can not load {}: {}".format(filename, error))
+                continue
+            self.backgrounds.append(image)
+
+    def background(self, number):
+        """preloaded background image number (modulo the number of loaded ones) in display
+           format, or None if none is loaded yet. Call it from the main thread"""
+        if not self.backgrounds:
+            return None
+        number %= len(self.backgrounds)
+        image = self.backgrounds[number]
+        if not self.is_fast(image):
+            image = self.backgrounds[number] = self.prepare(image)
+        return image
+
+    def is_fast(self, surface):
+        """True if SDL can blit surface to the display without converting the
+           pixels and without per pixel alpha"""
+        display = pygame.display.get_surface()
+        if display is not self.display:
+            self.display = display
+            self.format = None if display is None else (display.get_bitsize(), display.get_masks()[:3])
+            self.fast.clear()
+        return (not surface.get_flags() & pygame.SRCALPHA
+                and (surface.get_bitsize(), surface.get_masks()[:3]) == self.format)
+
+    def check(self, surfaces):
+        """count the blits of surfaces, and those that take a slow path"""
+        fast = self.fast
+        for surface in surfaces:
+            ok = fast.get(surface)
+            if ok is None:
+                ok = fast[surface] = self.is_fast(surface)
+            if not ok:
+                self.slow_blits += 1
+        self.blits += len(surfaces)
+
+    def stats(self):
+        return {"converted": self.converted, "pictures": len(self.pictures), "beams": len(self.beams),
+                "crosshairs": len(self.crosshairs), "backgrounds": len(self.backgrounds),
+                "blits": self.blits, "slow_blits": self.slow_blits}
+
+assets = Assets()
+
+
+def beam_image(color):
+    """returns the unrotated image of a laser beam, one shared image per color"""
+    return assets.beam(color)
+
 # generic pygame functions
 
 def make_text(text="@", font_color=(255, 0, 255), font_size=48, font_name = "mono", bold=True, grid_size=None):
@@ -26,12 +388,11 @@ def make_text(text="@", font_color=(255, 0, 255), font_size=48, font_name = "mon
        grid_size must be None or a tuple with positive integers.
        Use grid_size to scale the text to your desired dimension or None to just render it
        You still need to blit the surface.
+       The surface comes from text_cache, do not draw on it.
        Example: text with one char for font_size 48 returns the dimensions 29,49
     """
-    myfont = pygame.font.SysFont(font_name, font_size, bold)
-    size_x, size_y = myfont.size(text)
-    mytext = myfont.render(text, True, font_color)
-    mytext = mytext.convert_alpha() # pygame surface, use for blitting
+    mytext = text_cache.get(text, font_color, font_size, font_name, bold)
+    size_x, size_y = mytext.get_size()
     if grid_size is not None:
         try:
             mytext = pygame.transform.scale(mytext, grid_size)
@@ -49,47 +410,165 @@ def write(background, text, x=50, y=150, color=(0, 0, 0),
        the origin is the alignment of the text surface
        origin can be 'center', 'centercenter', 'topleft', 'topcenter', 'topright', 'centerleft', 'centerright',
        'bottomleft', 'bottomcenter', 'bottomright'
+       returns the rect of the text on background
     """
     if font_size is None:
         font_size = 24
-    font = pygame.font.SysFont(font_name, font_size, bold)
-    width, height = font.size(text)
-    surface = font.render(text, True, color)
+    surface = text_cache.get(text, color, font_size, font_name, bold)
+    width, height = surface.get_size()
 
     if origin == "center" or origin == "centercenter":
-        background.blit(surface, (x - width // 2, y - height // 2))
+        return background.blit(surface, (x - width // 2, y - height // 2))
     elif origin == "topleft":
-        background.blit(surface, (x, y))
+        return background.blit(surface, (x, y))
     elif origin == "topcenter":
-        background.blit(surface, (x - width // 2, y))
+        return background.blit(surface, (x - width // 2, y))
     elif origin == "topright":
-        background.blit(surface, (x - width , y))
+        return background.blit(surface, (x - width , y))
     elif origin == "centerleft":
-        background.blit(surface, (x, y - height // 2))
+        return background.blit(surface, (x, y - height // 2))
     elif origin == "centerright":
-        background.blit(surface, (x - width , y - height // 2))
+        return background.blit(surface, (x - width , y - height // 2))
     elif origin == "bottomleft":
-        background.blit(surface, (x , y - height ))
+        return background.blit(surface, (x , y - height ))
     elif origin == "bottomcenter":
-        background.blit(surface, (x - width // 2, y ))
+        return background.blit(surface, (x - width // 2, y ))
     elif origin == "bottomright":
-        background.blit(surface, (x - width, y - height))
+        return background.blit(surface, (x - width, y - height))
+
+
+class LayeredGroup(pygame.sprite.LayeredUpdates):
+    """LayeredUpdates with cheap removal of sprites.
+       LayeredUpdates.remove_internal searches the whole sprite list for every
+       killed sprite. Here killed sprites are only remembered, and dropped from
+       the sprite list in one pass the next time the list is needed (draw, add...)"""
+
+    def __init__(self, *sprites, **kwargs):
+        self._dead = set()
+        self._sprites = []
+        pygame.sprite.LayeredUpdates.__init__(self, *sprites, **kwargs)
+
+    @property
+    def _spritelist(self):
+        if self._dead:
+            dead = self._dead
+            self._sprites = [s for s in self._sprites if s not in dead]
+            dead.clear()
+        return self._sprites
+
+    @_spritelist.setter
+    def _spritelist(self, sprites):
+        self._dead.clear()
+        self._sprites = sprites
+
+    def add_internal(self, sprite, layer=None):
+        """Do not use this method directly. Same as LayeredUpdates.add_internal, but
+           without searching the place if the sprite belongs on top of all others"""
+        sprites = self._spritelist
+        if layer is None and sprites and isinstance(sprite, VectorSprite):
+            layer = sprite._layer
+            if self._spritelayers[sprites[-1]] <= layer:
+                self.spritedict[sprite] = self._init_rect
+                self._spritelayers[sprite] = layer
+                sprites.append(sprite)
+                return
+        pygame.sprite.LayeredUpdates.add_internal(self, sprite, layer)
+
+    def remove_internal(self, sprite):
+        """Do not use this method directly. Same as LayeredUpdates.remove_internal,
+           without removing the sprite from the sprite list"""
+        self._dead.add(sprite)
+        old_rect = self.spritedict[sprite]
+        if old_rect is not self._init_rect:
+            self.lostsprites.append(old_rect)  # dirty rect
+        if hasattr(sprite, "rect"):
+            self.lostsprites.append(sprite.rect)  # dirty rect
+        del self.spritedict[sprite]
+        del self._spritelayers[sprite]
+
+
+class SpritePool():
+    """free list of killed sprites of one class (Beam, Bubble, Flytext).
+       acquire() brings a killed sprite back to life with reset() instead of
+       creating a new object, VectorSprite.kill() gives it back with release().
+       Create pooled sprites only with acquire(), else the statistics are wrong"""
+
+    def __init__(self, sprite_class):
+        self.sprite_class = sprite_class
+        self.free = [] # killed sprites, waiting for reuse
+        self.allocations = 0 # new objects created
+        self.reuses = 0 # sprites taken from self.free
+        self.alive = 0
+        self.high_water = 0 # maximum of self.alive
+        self.start = time.perf_counter()
+
+    def acquire(self, *args, **kwargs):
+        """a sprite of sprite_class with these parameters, like sprite_class(*args, **kwargs)"""
+        if self.free:
+            sprite = self.free.pop()
+            sprite.reset(*args, **kwargs)
+            self.reuses += 1
+        else:
+            sprite = self.sprite_class(*args, **kwargs)
+            self.allocations += 1
+        self.alive += 1
+        if self.alive > self.high_water:
+            self.high_water = self.alive
+        return sprite
+
+    def release(self, sprite):
+        """called by VectorSprite.kill()"""
+        self.alive -= 1
+        self.free.append(sprite)
+
+    def stats(self):
+        """returns a dict with allocations, reuses, reuse ratio, high-water mark,
+           free sprites and allocations per second since the pool was created"""
+        total = self.allocations + self.reuses
+        seconds = time.perf_counter() - self.start
+        return {"allocations": self.allocations, "reuses": self.reuses,
+                "reuse_ratio": self.reuses / total if total > 0 else 0.0,
+                "high_water": self.high_water, "free": len(self.free),
+                "allocations_per_second": self.allocations / seconds if seconds > 0 else 0.0}
 
 
 class VectorSprite(pygame.sprite.Sprite):
-    """base class for sprites. this class inherits from pygames sprite class"""
-    number = 0
+    """base class for sprites. this class inherits from pygames sprite class.
+       The attributes are declared in __slots__, subclasses declare their own ones.
+       pygame's Sprite still has a __dict__ (for its groups), so other attributes
+       can be set too, they only need more memory"""
+    __slots__ = ("number", "pos", "move", "angle", "radius", "width", "height", "color",
+                 "hitpoints", "hitpointsfull", "stop_on_edge", "bounce_on_edge", "kill_on_edge",
+                 "warp_on_edge", "age", "max_age", "max_distance", "picture", "boss",
+                 "kill_with_boss", "move_with_boss", "underlings", "_layer",
+                 "image", "image0", "rect", "distance_traveled", "old_pos")
+    numbers = 0 # sprites created, for the unique number of each sprite
     #numbers = {} # { number, Sprite }
 
-    def __init__(self, **kwargs):
-        self._default_parameters(**kwargs)
+    pool = None # SpritePool of this class, for reusing killed sprites
+
+    def __init__(self, *args, **kwargs):
+        """the arguments of _default_parameters(), positional arguments are the fastest"""
+        self._default_parameters(*args, **kwargs)
         self._overwrite_parameters()
         pygame.sprite.Sprite.__init__(self, self.groups) #call parent class. NEVER FORGET !
-        self.number = VectorSprite.number # unique number for each sprite
-        VectorSprite.number += 1
+        self._start()
+
+    def reset(self, *args, **kwargs):
+        """bring a killed sprite back to life with new parameters, like __init__,
+           but without creating a new object and with the old image if possible. See SpritePool"""
+        self._default_parameters(*args, **kwargs)
+        self._overwrite_parameters()
+        self.add(self.groups)
+        self._start()
+
+    def _start(self):
+        self.number = VectorSprite.numbers # unique number for each sprite
+        VectorSprite.numbers += 1
         #VectorSprite.numbers[self.number] = self
         self.create_image()
         self.distance_traveled = 0 # in pixel
+        self.old_pos = pygame.math.Vector2(self.pos) # position before the last update
         #self.rect.center = (-300,-300) # avoid blinking image in topleft corner
         if self.angle != 0:
             self.set_angle(self.angle)
@@ -98,81 +577,68 @@ class VectorSprite(pygame.sprite.Sprite):
         """change parameters before create_image is called"""
         pass
 
-    def _default_parameters(self, **kwargs):
-        """get unlimited named arguments and turn them into attributes
-           default values for missing keywords"""
-
+    def _default_parameters(self, pos=None, move=None, angle=0, color=None, boss=None, radius=5,
+                            width=None, height=None, hitpoints=100, age=0, max_age=None, max_distance=None,
+                            picture=None, layer=0, stop_on_edge=False, bounce_on_edge=False,
+                            kill_on_edge=False, warp_on_edge=False, kill_with_boss=False,
+                            move_with_boss=False, **kwargs):
+        """turn the parameters into attributes. pos: random x if missing, color: random if missing.
+           age in seconds: a negative age means waiting time until sprite appears.
+           Other named arguments become attributes as well"""
+        self._layer = layer # pygame2: Sprite.layer is read-only property, use _layer
+        self.pos = pygame.math.Vector2(World.rng.randint(0, World.width),50) if pos is None else pos
+        self.move = pygame.math.Vector2(0,0) if move is None else move
+        self.angle = angle # 0: facing right
+        self.radius = radius
+        self.width = radius * 2 if width is None else width
+        self.height = radius * 2 if height is None else height
+        if color is None:
+            color = (World.rng.randint(0,255), World.rng.randint(0,255), World.rng.randint(0,255))
+        self.color = color
+        self.hitpoints = hitpoints
+        self.hitpointsfull = hitpoints # makes a copy
+        self.stop_on_edge = stop_on_edge
+        self.bounce_on_edge = bounce_on_edge
+        self.kill_on_edge = kill_on_edge
+        self.warp_on_edge = warp_on_edge
+        self.age = age
+        self.max_age = max_age
+        self.max_distance = max_distance
+        self.picture = picture
+        self.boss = boss
+        self.kill_with_boss = kill_with_boss
+        self.move_with_boss = move_with_boss
         for key, arg in kwargs.items():
             setattr(self, key, arg)
-        if "layer" not in kwargs:
-            self.layer = 0
-        else:
-            self.layer = self.layer
-        if "pos" not in kwargs:
-            self.pos = pygame.math.Vector2(random.randint(0, Viewer.width),50)
-        if "move" not in kwargs:
-            self.move = pygame.math.Vector2(0,0)
-        if "angle" not in kwargs:
-            self.angle = 0 # facing right?
-        if "radius" not in kwargs:
-            self.radius = 5
-        if "width" not in kwargs:
-            self.width = self.radius * 2
-        if "height" not in kwargs:
-            self.height = self.radius * 2
-        if "color" not in kwargs:
-            #self.color = None
-            self.color = (random.randint(0,255), random.randint(0,255), random.randint(0,255))
-        if "hitpoints" not in kwargs:
-            self.hitpoints = 100
-        self.hitpointsfull = self.hitpoints # makes a copy
-
-
-        if "stop_on_edge" not in kwargs:
-            self.stop_on_edge = False
-        if "bounce_on_edge" not in kwargs:
-            self.bounce_on_edge = False
-        if "kill_on_edge" not in kwargs:
-            self.kill_on_edge = False
-        if "warp_on_edge" not in kwargs:
-            self.warp_on_edge = False
-        if "age" not in kwargs:
-            self.age = 0  # age in seconds. A negative age means waiting time until sprite appears
-        if "max_age" not in kwargs:
-            self.max_age = None
-
-        if "max_distance" not in kwargs:
-            self.max_distance = None
-        if "picture" not in kwargs:
-            self.picture = None
-        if "boss" not in kwargs:
-            self.boss = None
-        if "kill_with_boss" not in kwargs:
-            self.kill_with_boss = False
-        if "move_with_boss" not in kwargs:
-            self.move_with_boss = False
+        # ---- register at the boss, so that kill() only needs to visit the underlings ----
+        self.underlings = None # set of sprites with this boss, made for the first one
+        if boss is not None:
+            if boss.underlings is None:
+                boss.underlings = set()
+            boss.underlings.add(self)
 
 
     def kill(self):
         # check if this is a boss and kill all his underlings as well
-        tokill = []
-        for s in Viewer.allgroup:
-            if "boss" in s.__dict__:
-                if s.boss == self:
-                    tokill.append(s)
-        for s in tokill:
-            s.kill()
+        if self.underlings:
+            for s in list(self.underlings):
+                s.kill()
+        if self.boss is not None and self.boss.underlings is not None:
+            self.boss.underlings.discard(self)
         #if self.number in self.numbers:
         #   del VectorSprite.numbers[self.number] # remove Sprite from numbers dict
-        pygame.sprite.Sprite.kill(self)
+        if self.alive():
+            pygame.sprite.Sprite.kill(self)
+            if self.pool is not None:
+                self.pool.release(self)
 
     def create_image(self):
         if self.picture is not None:
-            self.image = self.picture.copy()
+            self.image = assets.prepare(self.picture, self.picture.get_colorkey())
         else:
             self.image = pygame.Surface((self.width,self.height))
             self.image.fill((self.color))
-        self.image = self.image.convert_alpha()
+            self.image = assets.prepare(self.image)
         self.image0 = self.image.copy()
         self.rect= self.image.get_rect()
         self.width = self.rect.width
@@ -184,8 +650,7 @@ class VectorSprite(pygame.sprite.Sprite):
         self.angle += by_degree
         self.angle = self.angle % 360
         oldcenter = self.rect.center
-        self.image = pygame.transform.rotate(self.image0, -self.angle)
-        self.image.convert_alpha()
+        self.image = rotation_cache.get(self.image0, self.angle)
         self.rect = self.image.get_rect()
         self.rect.center = oldcenter
 
@@ -194,13 +659,13 @@ class VectorSprite(pygame.sprite.Sprite):
         self.angle = degree
         self.angle = self.angle % 360
         oldcenter = self.rect.center
-        self.image = pygame.transform.rotate(self.image0, -self.angle)
-        self.image.convert_alpha()
+        self.image = rotation_cache.get(self.image0, self.angle)
         self.rect = self.image.get_rect()
         self.rect.center = oldcenter
 
     def update(self, seconds):
         """calculate movement, position and bouncing on edge"""
+        self.old_pos = pygame.math.Vector2(self.pos) # for World.interpolate
         self.age += seconds
         if self.age < 0:
             return
@@ -234,39 +699,39 @@ class VectorSprite(pygame.sprite.Sprite):
                 self.pos.x = 0
                 self.move.x *= -1
             if self.warp_on_edge:
-                self.pos.x = Viewer.width
+                self.pos.x = World.width
         # -------- upper edge -----
-        # hud on top screen edge = 20 pixel = Viewer.hud_height
-        if self.pos.y  < Viewer.hud_height:
+        # hud on top screen edge = 20 pixel = World.hud_height
+        if self.pos.y  < World.hud_height:
             if self.stop_on_edge:
-                self.pos.y = Viewer.hud_height
+                self.pos.y = World.hud_height
             if self.kill_on_edge:
                 self.kill()
             if self.bounce_on_edge:
-                self.pos.y = Viewer.hud_height
+                self.pos.y = World.hud_height
                 self.move.y *= -1
             if self.warp_on_edge:
-                self.pos.y = Viewer.height
+                self.pos.y = World.height
         # -------- right edge -----
-        if self.pos.x  > Viewer.width:
+        if self.pos.x  > World.width:
             if self.stop_on_edge:
-                self.pos.x = Viewer.width
+                self.pos.x = World.width
             if self.kill_on_edge:
                 self.kill()
             if self.bounce_on_edge:
-                self.pos.x = Viewer.width
+                self.pos.x = World.width
                 self.move.x *= -1
             if self.warp_on_edge:
                 self.pos.x = 0
         # --------- lower edge ------------
-        if self.pos.y   > Viewer.height:
+        if self.pos.y   > World.height:
             if self.stop_on_edge:
-                self.pos.y = Viewer.height
+                self.pos.y = World.height
             if self.kill_on_edge:
                 self.hitpoints = 0
                 self.kill()
             if self.bounce_on_edge:
-                self.pos.y = PygView.height
+                self.pos.y = World.height
                 self.move.y *= -1
             if self.warp_on_edge:
                 self.pos.y = 0
@@ -274,17 +739,29 @@ class VectorSprite(pygame.sprite.Sprite):
 
 class Flytext(VectorSprite):
     """a text flying for a short time around, like hitpoints lost message"""
+    __slots__ = ("text", "fontsize", "acceleration_factor")
+
     def __init__(self, pos=pygame.math.Vector2(50,50), move=pygame.math.Vector2(0,-50),
                   text="hallo", color=(255, 0, 0), max_age=2, age=0,
                  acceleration_factor = 1.0,  fontsize=22,):
         """a text flying upward and for a short time and disappearing"""
-        VectorSprite.__init__(self, pos=pos, move=move, text=text, color=color,
-                              max_age=max_age, age=age, acceleration_factor=acceleration_factor,
-                              fontsize=fontsize)
+        self.text = text
+        self.fontsize = fontsize
+        self.acceleration_factor = acceleration_factor
+        VectorSprite.__init__(self, pos, move, color=color, max_age=max_age, age=age)
         self._layer = 7  # order of sprite layers (before / behind other sprites)
 
         #acceleration_factor  # if < 1, Text moves slower. if > 1, text moves faster.
 
+    def reset(self, pos=pygame.math.Vector2(50,50), move=pygame.math.Vector2(0,-50),
+              text="hallo", color=(255, 0, 0), max_age=2, age=0,
+              acceleration_factor = 1.0,  fontsize=22,):
+        self.text = text
+        self.fontsize = fontsize
+        self.acceleration_factor = acceleration_factor
+        VectorSprite.reset(self, pos, move, color=color, max_age=max_age, age=age)
+        self._layer = 7
+
     def create_image(self):
         self.image = make_text(self.text, (self.color), self.fontsize)[0]  # font 22
         self.rect = self.image.get_rect()
@@ -294,16 +771,18 @@ class Flytext(VectorSprite):
         #self.rect.center = (self.pos.x, self.pos.y)
 
     def update(self, seconds):
-        self.move *= self.acceleration_factor
+        self.move *= self.acceleration_factor ** (seconds * 60) # factor is per 1/60 second
         VectorSprite.update(self, seconds)
 
 class Bubble(VectorSprite):
-    """a round fragment or bubble particle"""
+    """a round fragment or bubble particle. Its random numbers come from World.bubble_rng,
+       so the number of bubbles (QualityGovernor) does not change the match"""
+    __slots__ = ("speed",)
 
 
     def _overwrite_parameters(self):
-        self.speed = random.randint(10,50)
-        self.max_age = 2+random.random()*2.4
+        self.speed = World.bubble_rng.randint(10,50)
+        self.max_age = 2+World.bubble_rng.random()*2.4
         self.kill_on_edge = True
         self.kill_with_boss = False # VERY IMPORTANT!!!
         if self.boss and self.move == pygame.math.Vector2(0,0):
@@ -314,55 +793,390 @@ class Bubble(VectorSprite):
         else:
             a, b = 0, 360
             self.move = pygame.math.Vector2(self.speed, 0)
-        self.move.rotate_ip(random.randint(a,b))
-        print("ich bin da", self.pos, self.move)
+        self.move.rotate_ip(World.bubble_rng.randint(a,b))
 
 
     def create_image(self):
-        self.radius = random.randint(1,5)
-        self.image = pygame.Surface((2*self.radius, 2*self.radius))
+        self.radius = World.bubble_rng.randint(1,5)
+        if getattr(self, "image", None) is not None and self.image.get_width() == 2*self.radius:
+            self.image.fill((0,0,0)) # reused from SpritePool
+        else: # not run length encoded, it is drawn on again when reused
+            self.image = assets.prepare(pygame.Surface((2*self.radius, 2*self.radius)), (0, 0, 0), rle=False)
         r,g,b = self.color
-        r+= random.randint(-30,30)
-        g+= random.randint(-30,30)
-        b+= random.randint(-30,30)
+        r+= World.bubble_rng.randint(-30,30)
+        g+= World.bubble_rng.randint(-30,30)
+        b+= World.bubble_rng.randint(-30,30)
         r = validcolor(r)
         g = validcolor(g)
         b = validcolor(b)
         self.color = (r,g,b)
         pygame.draw.circle(self.image, self.color, (self.radius, self.radius), self.radius )
-        self.image.set_colorkey((0,0,0))
-        self.image.convert_alpha()
         self.rect = self.image.get_rect()
 
 
 
+class SpatialHash():
+    """uniform grid for the broad phase of collision detection.
+       Objects (sprites) are inserted with their position and owner;
+       candidates() returns only objects in the 3x3 cells around a position,
+       without the objects of one owner. cell_size must be at least the
+       largest collision distance. For ArraySystems, build_array() and
+       candidates_array() do the same with numpy index arrays"""
+
+    def __init__(self, cell_size=64):
+        self.cell_size = cell_size
+        self.cells = {} # { (column, row): [(object, x, y, owner), ...] }
+        self.keys = None # build_array: sorted cell key for each position
+        self.order = None # build_array: index of the position for each sorted key
+        self.bounds = None # nearest: first and last column and row with objects
+
+    def cell(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def clear(self):
+        self.cells.clear()
+        self.bounds = None
+
+    def insert(self, thing, x, y, owner=None):
+        self.cells.setdefault(self.cell(x, y), []).append((thing, x, y, owner))
+        self.bounds = None
+
+    def candidates(self, x, y, owner=None):
+        """objects in the cells next to x,y, except those of owner"""
+        column, row = self.cell(x, y)
+        cells = self.cells
+        for c in (column - 1, column, column + 1):
+            for r in (row - 1, row, row + 1):
+                for thing, tx, ty, thing_owner in cells.get((c, r), ()):
+                    if owner is None or thing_owner is not owner:
+                        yield thing
+
+    def nearest(self, pos, exclude=None):
+        """the object (with a pos attribute) closest to pos, except exclude.
+           Searches rings of cells around pos, until no closer object is possible"""
+        if not self.cells:
+            return None
+        column, row = self.cell(pos.x, pos.y)
+        if self.bounds is None:
+            columns = [c for c, r in self.cells]
+            rows = [r for c, r in self.cells]
+            self.bounds = (min(columns), max(columns), min(rows), max(rows))
+        left, right, top, bottom = self.bounds
+        max_ring = max(abs(column - left), abs(column - right), abs(row - top), abs(row - bottom))
+        cells = self.cells
+        best, best_distance = None, None
+        for ring in range(max_ring + 1):
+            # only the cells on the border of the ring, the inside is already searched
+            if ring == 0:
+                border = [(column, row)]
+            else:
+                border = [(c, r) for c in range(column - ring, column + ring + 1) for r in (row - ring, row + ring)]
+                border += [(c, r) for r in range(row - ring + 1, row + ring) for c in (column - ring, column + ring)]
+            for key in border:
+                for thing, tx, ty, owner in cells.get(key, ()):
+                    if thing is exclude:
+                        continue
+                    distance = pos.distance_squared_to(thing.pos)
+                    if best_distance is None or distance < best_distance:
+                        best, best_distance = thing, distance
+            # everything in the next ring is at least ring * cell_size away
+            if best is not None and best_distance <= (ring * self.cell_size) ** 2:
+                break
+        return best
+
+    def build_array(self, positions, rows=None):
+        """index the positions (numpy array with shape (n, 2)) by cell"""
+        self.rows = rows if rows is not None else int(World.height // self.cell_size) + 3
+        cells = np.floor_divide(positions, self.cell_size).astype("int64") + 1 # +1: no negative rows
+        keys = cells[:, 0] * self.rows + np.clip(cells[:, 1], 0, self.rows - 1)
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+
+    def candidates_array(self, x, y):
+        """indices of the positions from build_array() in the cells next to x,y"""
+        return self.candidates_arrays([(x, y)])[0]
+
+    def candidates_arrays(self, points):
+        """candidates_array() for a list of (x, y) points at once, returns a list of index arrays"""
+        cells = np.floor_divide(np.array(points, dtype="float64"), self.cell_size).astype("int64") + 1
+        rows = np.clip(cells[:, 1], 0, self.rows - 1)
+        columns = cells[:, 0, None] + np.arange(-1, 2) # 3 columns for each point
+        # the 3 cells of one column are next to each other in self.keys
+        first = columns * self.rows + np.maximum(rows - 1, 0)[:, None]
+        last = columns * self.rows + np.minimum(rows + 1, self.rows - 1)[:, None]
+        starts = np.searchsorted(self.keys, first.ravel(), side="left").reshape(-1, 3).tolist()
+        ends = np.searchsorted(self.keys, last.ravel(), side="right").reshape(-1, 3).tolist()
+        order = self.order
+        result = []
+        for start, end in zip(starts, ends):
+            ranges = [order[a:b] for a, b in zip(start, end) if b > a]
+            result.append(np.concatenate(ranges) if ranges else np.zeros(0, dtype="int64"))
+        return result
+
+
+class ArraySystem():
+    """base class for objects stored as numpy arrays (structure of arrays) instead of sprites.
+       fields is a dict { attribute name: (shape of one element, dtype) }.
+       The living objects are in [:count] of each array, killed objects are
+       removed by moving the survivors to the front, so their slots get reused"""
+    fields = {}
+
+    def __init__(self, capacity=1024):
+        self.count = 0 # number of living objects
+        for name, (shape, dtype) in self.fields.items():
+            setattr(self, name, np.zeros((capacity,) + shape, dtype=dtype))
+
+    def __len__(self):
+        return self.count
+
+    def _reserve(self, count):
+        """make room for count new objects, returns the slice for them"""
+        capacity = len(self.age)
+        if self.count + count > capacity:
+            capacity = max(2 * capacity, self.count + count)
+            for name in self.fields:
+                old = getattr(self, name)
+                new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+                new[:self.count] = old[:self.count]
+                setattr(self, name, new)
+        return slice(self.count, self.count + count)
+
+    def _keep(self, alive):
+        """keep only the objects where the boolean array alive is True"""
+        if alive.all():
+            return
+        survivors = np.flatnonzero(alive)
+        k = len(survivors)
+        for name in self.fields:
+            array = getattr(self, name)
+            array[:k] = array[survivors]
+        self.count = k
+
+
+class ParticleSystem(ArraySystem):
+    """many Bubble particles without sprites. Position, velocity, age, max_age,
+       radius and color of all particles are stored in numpy arrays.
+       update() moves, ages and kills all particles at once,
+       draw() blits them with cached circle images (stamps). Needs numpy"""
+    color_step = 15 # color jitter is rounded to this, to keep the number of stamps small
+    fields = {"pos": ((2,), "float64"), "move": ((2,), "float64"), "age": ((), "float64"),
+              "max_age": ((), "float64"), "radius": ((), "int32"), "color": ((3,), "uint8"),
+              "stamp": ((), "int32")} # stamp: index in self.stamps
+
+    def __init__(self, capacity=1024, seed=None):
+        ArraySystem.__init__(self, capacity)
+        self.rng = np.random.default_rng(seed)
+        self.stamps = [] # circle images
+        self.stamp_numbers = {} # { (radius, color): index in self.stamps }
+        self.bursts = collections.deque(maxlen=256) # the last calls of emit(): (x, y, color, count)
+        self.burst_count = 0 # number of calls of emit()
+
+    def get_stamp(self, radius, color):
+        """index of the circle image for radius and color in self.stamps"""
+        key = (radius, color)
+        number = self.stamp_numbers.get(key)
+        if number is None:
+            image = pygame.Surface((2*radius, 2*radius))
+            pygame.draw.circle(image, color, (radius, radius), radius)
+            image = assets.prepare(image, (0, 0, 0))
+            number = len(self.stamps)
+            self.stamps.append(image)
+            self.stamp_numbers[key] = number
+        return number
+
+    def emit(self, x, y, color, count=1):
+        """burst of count particles at x,y, they behave like Bubble sprites:
+           random direction, speed 10-50, lifetime 2-4.4 seconds, radius 1-5, color +- 30"""
+        self.bursts.append((x, y, color, count))
+        self.burst_count += 1
+        new = self._reserve(count)
+        rng = self.rng
+        speed = rng.integers(10, 51, count)
+        angle = np.radians(rng.integers(0, 361, count))
+        self.pos[new] = (x, y)
+        self.move[new, 0] = speed * np.cos(angle)
+        self.move[new, 1] = speed * np.sin(angle)
+        self.age[new] = 0
+        self.max_age[new] = 2 + rng.random(count) * 2.4
+        radius = rng.integers(1, 6, count)
+        jitter = rng.integers(-2, 3, (count, 3)) * self.color_step
+        colors = np.clip(np.array(color[:3]) + jitter, 0, 255)
+        self.radius[new] = radius
+        self.color[new] = colors
+        # ---- one stamp lookup for each different (radius, color) of this burst ----
+        keys = (radius << 24) | (colors[:, 0] << 16) | (colors[:, 1] << 8) | colors[:, 2]
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        numbers = np.array([self.get_stamp(int(k >> 24), (int(k >> 16) & 255, int(k >> 8) & 255, int(k) & 255))
+                            for k in unique_keys], dtype=np.int32)
+        self.stamp[new] = numbers[inverse.reshape(-1)]
+        self.count = new.stop
+
+    def update(self, seconds):
+        """move and age all particles, kill them on the screen edge or when too old"""
+        n = self.count
+        if n == 0:
+            return
+        self.age[:n] += seconds
+        pos = self.pos[:n]
+        pos += self.move[:n] * seconds
+        x, y = pos[:, 0], pos[:, 1]
+        alive = ((self.age[:n] <= self.max_age[:n]) & (x >= 0) & (x <= World.width)
+                 & (y >= World.hud_height) & (y <= World.height))
+        self._keep(alive)
+
+    def draw(self, surface, behind=0.0, rects=False):
+        """blit all particles. behind (in seconds) moves them back along their
+           movement, for drawing between two physics steps.
+           If rects is True, returns the list of changed rects"""
+        n = self.count
+        if n == 0:
+            return []
+        topleft = self.pos[:n] - self.move[:n] * behind - self.radius[:n, None]
+        stamps = self.stamps
+        return surface.blits([(stamps[i], (x, y)) for i, x, y in
+                              zip(self.stamp[:n].tolist(), topleft[:, 0].tolist(), topleft[:, 1].tolist())],
+                             doreturn=rects)
+
+
 class Beam(VectorSprite):
     """laser-beam, need color, pos, move and angle """
+    __slots__ = ("damage",)
 
     def _overwrite_parameters(self):
         self.kill_on_edge = True
         self._layer = 7
         self.max_age = 5
         self.max_distance = 400
-        self.damage = 1
+        self.damage = self.boss.damage if isinstance(self.boss, Player) else 1 # other bosses have no damage
         self.radius = 5
         self.hitpoints = 1
 
 
     def create_image(self):
-        self.image = pygame.Surface((20, 20))
-        pygame.draw.line(self.image, self.color, (0, 10), (20, 10), 3)
-        #pygame.draw.line(self.image, (255,255,255), (2, 10), (18, 10), 1)
-        self.image.set_colorkey((0, 0, 0))
-        self.image = self.image.convert_alpha()
-        self.image0 = self.image.copy()
+        self.image0 = beam_image(self.color) # shared by all beams of this color
+        self.image = self.image0
         self.rect= self.image.get_rect()
         self.width = self.rect.width
-        self.height = self.rect.height
-        self.set_angle(self.angle)
+        self.height = self.rect.height # rotated by _start()
+
+
+class BeamSystem(ArraySystem):
+    """all laser beams in numpy arrays instead of Beam sprites.
+       update() moves and ages all beams at once, with the same rules as a
+       Beam sprite: max_age, max_distance and the screen edge rules of
+       VectorSprite.wallcheck(). Needs numpy"""
+    # edge rules, bitmask in the array 'edge', applied in this order like in wallcheck()
+    STOP = 1
+    KILL = 2
+    BOUNCE = 4
+    WARP = 8
+    max_age = 5
+    max_distance = 400
+    radius = 5
+    fields = {"pos": ((2,), "float64"), "move": ((2,), "float64"), "angle": ((), "float64"),
+              "age": ((), "float64"), "distance_traveled": ((), "float64"), "owner": ((), "int32"),
+              "damage": ((), "int32"), "edge": ((), "int32"), "image": ((), "int32"),
+              "id": ((), "int64")} # owner: playernumber, image: index in self.images
+
+    def __init__(self, capacity=1024):
+        ArraySystem.__init__(self, capacity)
+        self.next_id = 1 # ids are increasing, so the id array of the living beams is sorted
+        self.images = [] # unrotated beam images, see beam_image()
+        self.image_numbers = {} # { color: index in self.images }
+        self.colors = [] # color for each image
+
+    def add(self, owner, pos, move, angle, color, damage=1, edge=KILL):
+        """a new beam, fired by the player with playernumber owner"""
+        color = tuple(color)
+        number = self.image_numbers.get(color)
+        if number is None:
+            number = len(self.images)
+            self.images.append(beam_image(color))
+            self.colors.append(color)
+            self.image_numbers[color] = number
+        i = self._reserve(1).start
+        self.pos[i] = (pos.x, pos.y)
+        self.move[i] = (move.x, move.y)
+        self.angle[i] = angle
+        self.age[i] = 0
+        self.distance_traveled[i] = 0
+        self.owner[i] = owner
+        self.damage[i] = damage
+        self.edge[i] = edge
+        self.image[i] = number
+        self.id[i] = self.next_id
+        self.next_id += 1
+        self.count += 1
+
+    def update(self, seconds):
+        """move and age all beams, apply the edge rules, kill too old or too far traveled beams"""
+        n = self.count
+        if n == 0:
+            return
+        age = self.age[:n]
+        age += seconds
+        move = self.move[:n]
+        self.distance_traveled[:n] += np.hypot(move[:, 0], move[:, 1]) * seconds
+        alive = (age <= self.max_age) & (self.distance_traveled[:n] <= self.max_distance)
+        pos = self.pos[:n]
+        pos += move * seconds
+        # ---- edge rules, for each edge in the order of wallcheck(): stop, kill, bounce, warp ----
+        edge = self.edge[:n]
+        stop, kill = (edge & self.STOP) > 0, (edge & self.KILL) > 0
+        bounce, warp = (edge & self.BOUNCE) > 0, (edge & self.WARP) > 0
+        x, y, mx, my = pos[:, 0], pos[:, 1], move[:, 0], move[:, 1]
+        for over, coordinate, movement, limit, warp_to in (
+                (x < 0, x, mx, 0, World.width),
+                (y < World.hud_height, y, my, World.hud_height, World.height),
+                (x > World.width, x, mx, World.width, 0),
+                (y > World.height, y, my, World.height, 0)):
+            if not over.any():
+                continue
+            coordinate[over & stop] = limit
+            alive &= ~(over & kill)
+            coordinate[over & bounce] = limit
+            movement[over & bounce] *= -1
+            coordinate[over & warp] = warp_to
+        self._keep(alive)
+
+    def hits(self, pos, radius, owner, candidates=None):
+        """sorted indices of beams touching a circle at pos, not fired by owner.
+           candidates: index array of the beams to test (from SpatialHash.candidates_array), or None for all"""
+        if candidates is None:
+            candidates = np.arange(self.count)
+        candidates = candidates[self.owner[candidates] != owner]
+        d = self.pos[candidates] - (pos.x, pos.y)
+        touch = d[:, 0] ** 2 + d[:, 1] ** 2 <= (radius + self.radius) ** 2
+        return np.sort(candidates[touch])
+
+    def kill(self, indices):
+        """kill the beams with these indices"""
+        alive = np.ones(self.count, dtype=bool)
+        alive[indices] = False
+        self._keep(alive)
+
+    def draw(self, surface, behind=0.0, rects=False):
+        """blit all beams, rotated by rotation_cache. behind (in seconds) moves
+           them back along their movement, for drawing between two physics steps.
+           If rects is True, returns the list of changed rects"""
+        n = self.count
+        if n == 0:
+            return []
+        center = self.pos[:n] - self.move[:n] * behind
+        images = self.images
+        blits = []
+        for number, angle, x, y in zip(self.image[:n].tolist(), self.angle[:n].tolist(),
+                                       center[:, 0].tolist(), center[:, 1].tolist()):
+            image = rotation_cache.get(images[number], angle)
+            w, h = image.get_size()
+            blits.append((image, (round(x) - w // 2, round(y) - h // 2)))
+        return surface.blits(blits, doreturn=rects)
 
 
 class Player(VectorSprite):
+    __slots__ = ("playernumber", "name", "turnspeed", "movespeed", "friction", "cannon_angle", "firespeed",
+                 "aiming", "target", "reload_time", "last_shot", "cannon_turn_speed", "damage",
+                 "shots", "hits", "game_over")
 
     aimings = ["free", "forward", "fixed", "locked"]
 
@@ -389,23 +1203,28 @@ class Player(VectorSprite):
         #self.button1_wait = 0.35
         self.last_shot = 0 # time of last shot
         self.cannon_turn_speed = 150 # degrees per second
+        self.damage = 1 # of each beam
+        self.shots = 0 # beams fired
+        self.hits = 0 # beams that hit another player
+        self.game_over = False # kill() was done
 
         Crosshair(boss=self)
 
     def switch_target(self):
         if self.hitpoints <= 0:
             return
-        """select the next target out of the self.targets list
-        that looks like ['nearest', 'green', 'red', 'yellow']"""
-
-        if self.target not in self.targets:
-            self.target = self.targets[0]
+        """select the next target out of the World.targets list
+        that looks like ['nearest', 'blue', 'green', 'red', 'yellow'], except the own name"""
+        targets = World.targets
+        if self.target not in targets:
+            self.target = targets[0]
             return
-        i = self.targets.index(self.target)
-        if i == len(self.targets)-1:
-            self.target = self.targets[0]
-        else:
-            self.target = self.targets[i+1]
+        i = targets.index(self.target)
+        for _ in range(len(targets)):
+            i = (i + 1) % len(targets)
+            if targets[i] != self.name:
+                break
+        self.target = targets[i]
         #print("target is now:", self.target)
 
 
@@ -431,12 +1250,16 @@ class Player(VectorSprite):
         if self.age < (self.last_shot + self.reload_time):
             return # gun is too hot now, wait for cooldown
         self.last_shot = self.age
+        self.shots += 1
         m = pygame.math.Vector2(self.firespeed, 0)
         m.rotate_ip(self.cannon_angle)
         #m += self.move
         p = pygame.math.Vector2(self.pos.x, self.pos.y)
         a = self.cannon_angle
-        Beam(boss=self, pos=p, move=m, color=self.color, angle=a)
+        if World.beams is not None:
+            World.beams.add(self.playernumber, p, m, a, self.color, self.damage)
+        else:
+            Beam.pool.acquire(p, m, a, self.color, self) # pos, move, angle, color, boss
 
     def aim(self, seconds, factor):
         """turn the cannon/crosshair, depending on aiming mode"""
@@ -494,16 +1317,26 @@ class Player(VectorSprite):
         if colorstring == "nearest":
             best = self.get_closest_player()
         else:
-            best = [p for p in Viewer.playergroup if p.name == colorstring][0]
+            best = World.player_names.get(colorstring)
+        if best is None:
+            return # nobody left
         v = best.pos - self.pos
         a = -v.angle_to(pygame.math.Vector2(1, 0))
         self.cannon_angle = a
 
     def get_closest_player(self):
+        """the nearest living player. Found with World.player_grid (only living players)
+           and remembered in World.nearest until the grid is built again"""
+        if self.playernumber in World.nearest:
+            return World.nearest[self.playernumber]
+        if World.player_grid is not None and World.player_grid.cells:
+            best = World.player_grid.nearest(self.pos, exclude=self)
+            World.nearest[self.playernumber] = best
+            return best
         best_distance = None
-        # best = None
-        for p in Viewer.playergroup:
-            if p == self:
+        best = None
+        for p in World.playergroup:
+            if p == self or p.hitpoints <= 0:
                 continue
             dist = (p.pos - self.pos).length()
             if best_distance is None or best_distance > dist:
@@ -511,20 +1344,14 @@ class Player(VectorSprite):
                 best = p
         return best
 
-    def valid_targets(self):
-        """list of valid target names. """
-        self.targets = ["nearest"]
-        for p in Viewer.playergroup:
-            if p.hitpoints > 0 and p != self:
-                self.targets.append(p.name)
-        #print("targets aquired for {}: {}".format(self.name, self.targets))
-
-
     def kill(self):
-        # remove own name from Player.targets and update all players
-        for p in Viewer.playergroup:
-            p.valid_targets()
-        Flytext(pos=pygame.math.Vector2(self.pos.x, self.pos.y), text="Game over for {} player ".format(self.name),
+        if self.game_over:
+            return # VectorSprite.update calls kill() as long as hitpoints <= 0
+        self.game_over = True
+        # remove own name from the targets of all players
+        if self.name in World.targets:
+            World.targets.remove(self.name)
+        Flytext.pool.acquire(pos=pygame.math.Vector2(self.pos.x, self.pos.y), text="Game over for {} player ".format(self.name),
                 color=self.color, max_age=1  )
         ## don't kill because this would mess up joystick control.
         ## instead, just move the dead player out of the screen
@@ -533,11 +1360,11 @@ class Player(VectorSprite):
         self.move = pygame.math.Vector2(0,0)
         #self.rect.center = (round(self.pos.x, 0), round(self.pos.y, 0))
         ##VectorSprite.kill(self)
-        survivors = [p for p in Viewer.playergroup if p.hitpoints > 0]
+        survivors = [p for p in World.playergroup if not p.game_over]
         if len(survivors) == 1:
-            Flytext(pos=pygame.math.Vector2(Viewer.width//2, Viewer.height -50), color=survivors[0].color,
+            Flytext.pool.acquire(pos=pygame.math.Vector2(World.width//2, World.height -50), color=survivors[0].color,
                     max_age=10, fontsize=33, text="Victory for {} player!".format(survivors[0].name))
-            Flytext(pos=pygame.math.Vector2(Viewer.width, 100), text="press r to restart the game",
+            Flytext.pool.acquire(pos=pygame.math.Vector2(World.width, 100), text="press r to restart the game",
                     move=pygame.math.Vector2(-5,0), max_age=30)
 
     # DONE : aiming update when one player is killed
@@ -545,7 +1372,7 @@ class Player(VectorSprite):
     def update(self, seconds):
         #if self.hitpoints <= 0:
         #    return
-        self.move *= self.friction
+        self.move *= self.friction ** (seconds * 60) # friction is per 1/60 second
         if self.aiming == "locked":
             self.aim_at_player(self.target)
 
@@ -553,99 +1380,357 @@ class Player(VectorSprite):
         #print(self.move, self.angle)
 
 class Crosshair(VectorSprite):
+    __slots__ = ("boss_distance",)
+    simple = False # small cross instead of circles, set by QualityGovernor
 
     def _overwrite_parameters(self):
         self.move = pygame.math.Vector2(0,0)
         self.boss_distance = pygame.math.Vector2(85,0)
 
     def create_image(self):
-        self.image = pygame.Surface((30,30))
-        pygame.draw.line(self.image, self.boss.color, (0,0), (30,30),1)
-        pygame.draw.line(self.image, self.boss.color, (30, 0), (0, 30), 1)
-        pygame.draw.circle(self.image, (10,10,10), (15,15), 15, 1)
-        pygame.draw.circle(self.image, self.boss.color, (15, 15), 10, 1)
-        pygame.draw.circle(self.image, (10, 10, 10), (15, 15), 5, 1)
-        pygame.draw.circle(self.image, (0, 0, 0), (15, 15), 2, 0)  # black -> transparent. makes a hole
-        self.image.set_colorkey((0,0,0))
-        self.image.convert_alpha()
+        self.image = assets.crosshair(self.boss.color, Crosshair.simple)
         self.rect = self.image.get_rect()
         self.width = self.rect.width
         self.height = self.rect.height
 
 
     def update(self, seconds):
+        if assets.crosshair(self.boss.color, Crosshair.simple) is not self.image:
+            center = self.rect.center
+            self.create_image()
+            self.rect.center = center
         self.boss_distance = pygame.math.Vector2(85, 0)
         self.boss_distance.rotate_ip(self.boss.cannon_angle)
         self.pos = self.boss.pos + self.boss_distance
         VectorSprite.update(self,seconds)
 
-class Viewer():
+class FrameProfiler():
+    """measures the time of each phase of a frame (events, input, physics, drawing...)
+       with perf_counter_ns. Call begin_frame() at the start of each frame and
+       lap(phase) at the end of each phase: the time since the last lap is
+       given to that phase. The last 'size' frames are kept in a ring buffer,
+       for the overlay and for export as csv or chrome trace (chrome://tracing)"""
+    phases = ("events", "input", "fire", "update", "collision",
+              "background", "draw", "fps", "hud", "flip", "capture")
+    colors = ((255, 255, 255), (255, 128, 0), (255, 0, 0), (0, 200, 0), (0, 255, 255),
+              (128, 128, 128), (0, 0, 255), (255, 0, 255), (128, 0, 255), (0, 128, 64), (255, 255, 0))
+    budget_ms = 1000 / 60 # one frame at 60 fps
+
+    def __init__(self, size=600):
+        self.size = size
+        self.buffer = [None] * size # each frame: (start, [(phase, start, duration), ...]), times in ns
+        self.index = 0 # next place in buffer
+        self.count = 0 # frames in buffer
+        self.events = None # events of the running frame
+        self.frame_start = 0
+        self.mark = 0
+        self.overlay = None
+        self.quality = None # level of the QualityGovernor in the last overlay
+
+    def begin_frame(self):
+        """ends the running frame and starts a new one"""
+        now = time.perf_counter_ns()
+        if self.events is not None:
+            self.buffer[self.index] = (self.frame_start, self.events)
+            self.index = (self.index + 1) % self.size
+            self.count = min(self.count + 1, self.size)
+        self.events = []
+        self.frame_start = self.mark = now
+
+    def lap(self, phase):
+        """the time since the last lap (or begin_frame) belongs to phase"""
+        now = time.perf_counter_ns()
+        self.events.append((phase, self.mark, now - self.mark))
+        self.mark = now
+
+    def frames(self):
+        """finished frames in the buffer, oldest first"""
+        start = (self.index - self.count) % self.size
+        return [self.buffer[(start + i) % self.size] for i in range(self.count)]
+
+    def totals(self, events):
+        """milliseconds for each phase of one frame, in the order of self.phases"""
+        ms = dict.fromkeys(self.phases, 0.0)
+        for phase, start, duration in events:
+            ms[phase] = ms.get(phase, 0.0) + duration / 1e6
+        return [ms[phase] for phase in self.phases]
+
+    def draw_overlay(self, surface, x, y, fps, width=240, height=100, quality=None):
+        """stacked bars of phase times, newest frame on the right, with the fps, the
+           level of a QualityGovernor (quality) and a line for budget_ms.
+           A change of quality is marked with a yellow line. x,y is the bottomright corner. Returns the rect"""
+        scale = height / (2 * self.budget_ms) # pixel per ms, 2 frame budgets fit
+        if self.overlay is None or self.overlay.get_size() != (width, height):
+            self.overlay = pygame.Surface((width, height))
+            self.overlay.fill((20, 20, 20))
+        overlay = self.overlay
+        overlay.scroll(-2, 0)
+        overlay.fill((20, 20, 20), (width - 2, 0, 2, height))
+        if quality != self.quality and self.quality is not None:
+            overlay.fill((255, 255, 0), (width - 2, 0, 1, height))
+        self.quality = quality
+        if self.count > 0:
+            bottom = height
+            for color, ms in zip(self.colors, self.totals(self.buffer[(self.index - 1) % self.size][1])):
+                h = ms * scale
+                if h >= 0.5:
+                    pygame.draw.rect(overlay, color, (width - 2, round(bottom - h), 2, max(1, round(h))))
+                bottom -= h
+        rect = surface.blit(overlay, (x - width, y - height))
+        budget_y = rect.bottom - round(self.budget_ms * scale)
+        pygame.draw.line(surface, (255, 0, 0), (rect.left, budget_y), (rect.right - 1, budget_y))
+        text = "FPS: {:8.3}".format(fps) + ("  quality level {}".format(quality) if quality is not None else "")
+        write(surface, text=text, x=rect.left + 2, y=rect.top + 2, font_size=12, color=(255, 255, 255))
+        return rect
+
+    def dump_csv(self, filename="profile.csv"):
+        """one line per frame: milliseconds for each phase and the total"""
+        with open(filename, "w") as f:
+            f.write("frame,start_ms," + ",".join(self.phases) + ",total\n")
+            for number, (start, events) in enumerate(self.frames()):
+                ms = self.totals(events)
+                f.write("{},{:.3f},".format(number, start / 1e6) + ",".join("{:.4f}".format(m) for m in ms)
+                        + ",{:.4f}\n".format(sum(ms)))
+
+    def dump_trace(self, filename="profile_trace.json"):
+        """chrome trace event format, open with chrome://tracing or https://ui.perfetto.dev"""
+        trace = []
+        for number, (start, events) in enumerate(self.frames()):
+            duration = sum(e[2] for e in events)
+            trace.append({"name": "frame {}".format(number), "ph": "X", "pid": 1, "tid": 1,
+                          "ts": start / 1000, "dur": duration / 1000})
+            for phase, phase_start, phase_duration in events:
+                trace.append({"name": phase, "ph": "X", "pid": 1, "tid": 1,
+                              "ts": phase_start / 1000, "dur": phase_duration / 1000})
+        with open(filename, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+    def dump(self):
+        self.dump_csv()
+        self.dump_trace()
+        print("profile of {} frames written to profile.csv and profile_trace.json".format(self.count))
+
+
+class StartupTimer():
+    """milliseconds of each startup phase, from launch_time (the import of this module,
+       which includes the import of pygame and numpy) to the first frame on the screen.
+       lap(phase) gives the time since the last lap to that phase"""
+
+    def __init__(self, start=None):
+        self.start = self.last = launch_time if start is None else start
+        self.phases = [] # (phase, milliseconds)
+        self.done = False
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, (now - self.last) * 1000))
+        self.last = now
+
+    def finish(self, phase="first frame"):
+        """last lap, prints the report"""
+        self.lap(phase)
+        self.done = True
+        print(self.report())
+
+    def total(self):
+        return (self.last - self.start) * 1000
+
+    def report(self):
+        return "startup: {:.0f} ms to the first frame ({})".format(
+               self.total(), ", ".join("{} {:.0f}".format(phase, ms) for phase, ms in self.phases))
+
+
+class QualityGovernor():
+    """holds the frame rate by lowering the quality when frames take too long.
+       frame(milliseconds) gets the busy time of each frame (without waiting for the
+       clock). If the mean of the last 'window' frames is above high * budget, the
+       level goes up (less quality), below low * budget it goes down again.
+       Hysteresis: the thresholds are far apart, each level is kept for at least
+       'hold' frames, and a level that was restored too early (it had to go up again
+       at once) waits twice as long before the next restore, up to 16 times hold.
+       Bubbles have their own random numbers (World.bubble_rng), so a level never changes
+       the match and recordings replay the same"""
+    levels = ( # level 0 is full quality
+        {"bubble_chance": 0.85, "max_bubbles": None, "simple_crosshair": False, "hud_every": 1, "rotation_step": 1},
+        {"bubble_chance": 0.6, "max_bubbles": 6000, "simple_crosshair": False, "hud_every": 2, "rotation_step": 1},
+        {"bubble_chance": 0.4, "max_bubbles": 3000, "simple_crosshair": True, "hud_every": 4, "rotation_step": 3},
+        {"bubble_chance": 0.2, "max_bubbles": 1000, "simple_crosshair": True, "hud_every": 8, "rotation_step": 6})
+
+    def __init__(self, fps=60, window=30, high=0.9, low=0.6, hold=60):
+        self.budget_ms = 1000 / fps
+        self.window = collections.deque(maxlen=window) # busy milliseconds of the last frames
+        self.high = high
+        self.low = low
+        self.hold = hold # frames to stay at a level
+        self.restore_hold = [hold] * len(self.levels) # frames before going down from each level
+        self.level = 0
+        self.frames = 0 # frames at this level
+        self.transitions = [] # (frame number, old level, new level, mean milliseconds)
+        self.frame_number = 0
+
+    def frame(self, milliseconds):
+        """busy time of one frame. Returns the new level if it changed, else None"""
+        self.frame_number += 1
+        self.frames += 1
+        self.window.append(milliseconds)
+        if len(self.window) < self.window.maxlen or self.frames < self.hold:
+            return None
+        mean = sum(self.window) / len(self.window)
+        if mean > self.high * self.budget_ms and self.level < len(self.levels) - 1:
+            level = self.level + 1
+            if self.transitions and self.transitions[-1][1:3] == (level, self.level) and self.frames < 4 * self.hold:
+                # restored too early, wait longer next time
+                self.restore_hold[level] = min(2 * self.restore_hold[level], 16 * self.hold)
+        elif (mean < self.low * self.budget_ms and self.level > 0
+              and self.frames >= self.restore_hold[self.level]):
+            level = self.level - 1
+        else:
+            return None
+        self.transitions.append((self.frame_number, self.level, level, mean))
+        self.level = level
+        self.frames = 0
+        self.window.clear()
+        return level
+
+    def apply(self, world, viewer=None):
+        """set the values of the current level in world, the sprite classes, rotation_cache and viewer"""
+        values = self.levels[self.level]
+        world.bubble_chance = values["bubble_chance"]
+        world.max_bubbles = values["max_bubbles"]
+        Crosshair.simple = values["simple_crosshair"]
+        rotation_cache.set_step(values["rotation_step"], clear=False) # prewarmed images stay
+        if viewer is not None:
+            viewer.hud_every = values["hud_every"]
+
+    def stats(self):
+        return "level {}, {} changes".format(self.level, len(self.transitions)) + "".join(
+               ", {}->{} at frame {} ({:.1f} ms)".format(old, new, number, ms)
+               for number, old, new, ms in self.transitions[-8:])
+
+
+def joysticks_present():
+    """False if surely no joystick is connected. On linux: no /dev/input/js*, no joystick
+       link of udev and no event device with joystick or gamepad buttons (sysfs capabilities).
+       True on other systems. The environment variable VECTORGAME_JOYSTICKS overrides
+       it: 1 always starts the joystick subsystem, 0 never"""
+    force = os.environ.get("VECTORGAME_JOYSTICKS")
+    if force in ("0", "1"):
+        return force == "1"
+    if not sys.platform.startswith("linux"):
+        return True
+    if glob.glob("/dev/input/js*") or glob.glob("/dev/input/by-id/*joystick*"):
+        return True
+    bits = struct.calcsize("P") * 8 # the kernel writes the bitmap as hex words of a long, highest first
+    for filename in glob.glob("/sys/class/input/event*/device/capabilities/key"):
+        try:
+            with open(filename) as f:
+                words = f.read().split()
+        except OSError:
+            continue
+        keys = 0
+        for word in words:
+            keys = (keys << bits) | int(word, 16)
+        if keys >> 0x120 & 0xffffffff: # BTN_JOYSTICK 0x120 .. 0x12f and BTN_GAMEPAD 0x130 .. 0x13f
+            return True
+    return False
+
+
+def init_joysticks():
+    """returns a list of initialized joysticks. The joystick subsystem of SDL
+       is only started if a joystick is present"""
+    if not joysticks_present():
+        return []
+    pygame.joystick.init()
+    joysticks = [pygame.joystick.Joystick(x) for x in range(pygame.joystick.get_count())]
+    for j in joysticks:
+        j.init()
+    return joysticks
+
+
+def init_headless():
+    """initialize pygame with SDL's dummy video driver: no window is opened,
+       but surfaces can still be converted and text rendered.
+       Use this before creating a World without a Viewer"""
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    pygame.display.init()
+    pygame.font.init()
+    pygame.display.set_mode((1, 1))
+
+
+# input of one player for one physics step.
+# turn: -1 (left) .. 1 (right), thrust: -1 (backward) .. 1 (forward), aim: -1 .. 1 (cannon turn)
+# switches: bitmask of SWITCH_AIMING and SWITCH_TARGET, for button presses
+Command = collections.namedtuple("Command", ["turn", "thrust", "aim", "switches"], defaults=[0, 0, 0, 0])
+SWITCH_AIMING = 1
+SWITCH_TARGET = 2
+# joystick buttons: SWITCH_ bits when released, direction of aim while pressed
+JOY_SWITCH_BUTTONS = {0: SWITCH_AIMING, 6: SWITCH_AIMING, 1: SWITCH_TARGET, 7: SWITCH_TARGET}
+JOY_AIM_BUTTONS = {2: 1, 3: -1, 4: -1, 5: 1}
+# keys for the whole world, bitmask for World.step
+KEY_RESET = 1 # restart and reset all players
+KEY_TEST = 2 # test explosion
+
+
+class World():
+    """the simulation: sprite groups, players and collision detection.
+       Needs no display and no Viewer, advance it with step(seconds).
+       All randomness of the match comes from World.rng, seeded with seed: the same seed
+       and the same commands for each step give the same match. Bubbles are only
+       cosmetic, they have their own generators (bubble_rng, ParticleSystem.rng) and
+       never take numbers from World.rng, so lowering their number changes nothing else"""
     width = 0
     height = 0
     hud_height = 20 # height of hud on top of screen, for displaying hitpoints etc
     allgroup = None # pygame sprite Group for all sprites
     playergroup = None # pygame sprite Group only for players
-    players = []
-
-    def __init__(self,width=800, height=600 ):
-        Viewer.width = width
-        Viewer.height = height
-        # ---- pygame init
-        pygame.init()
-        # ------ joysticks init ----
-        pygame.joystick.init()
-        self.joysticks = [pygame.joystick.Joystick(x) for x in range(pygame.joystick.get_count())]
-        for j in self.joysticks:
-            j.init()
-        self.screen = pygame.display.set_mode((self.width, self.height), pygame.DOUBLEBUF)
-        self.clock = pygame.time.Clock()
-        self.fps = 60
+    rng = random.Random() # random generator of the current world, used by all sprites
+    bubble_rng = random.Random() # random generator for Bubble sprites of the current world
+    beams = None # BeamSystem of the current world, or None for Beam sprites
+    player_grid = None # SpatialHash of all living players, built at the start of each step
+    player_names = {} # name: Player
+    targets = [] # 'nearest' and the names of all living players, for Player.switch_target
+    nearest = {} # playernumber: nearest living Player, cached until player_grid is built again
+    tickrate = 120 # physics steps per second, see Viewer.run
+
+    def __init__(self, width=800, height=600, seed=None, particles=True, beams=True, players=4, bots=0):
+        """players: number of players, the last bots of them are steered by the computer"""
+        if players < 1 or not 0 <= bots <= players:
+            raise ValueError("need at least 1 player and 0 to {} bots, not {} players and {} bots".format(
+                             max(players, 0), players, bots))
+        World.width = width
+        World.height = height
+        self.seed = seed
+        self.rng = random.Random(seed)
+        World.rng = self.rng
+        self.bubble_rng = random.Random(self.bubble_seed(seed))
+        World.bubble_rng = self.bubble_rng
+        # ---- bubbles and beams in numpy arrays, or as Bubble and Beam sprites without numpy ----
+        self.particles = None
+        if particles and np is not None:
+            self.particles = ParticleSystem(seed=self.rng.getrandbits(32))
+        self.bubble_chance = 0.85 # chance of bubbles where a beam hits, lowered by QualityGovernor
+        self.max_bubbles = None # limit for living bubbles (particles or Bubble sprites), None: no limit
+        self.beams = None
+        if beams and np is not None:
+            self.beams = BeamSystem()
+        World.beams = self.beams
+        # ---- broad phase for collision detection and nearest player ----
+        self.beam_grid = SpatialHash(64) # for Beam sprites or the BeamSystem
+        self.player_grid = SpatialHash(128)
+        World.player_grid = self.player_grid
+        self.dt = 1 / self.tickrate # seconds per physics step
+        self.profiler = None # FrameProfiler, set by Viewer
+        self.ticks = 0 # number of physics steps done
         self.playtime = 0.0
-        # ------ background images ------
-        self.backgroundfilenames = []  # every .jpg or .jpeg file in the folder 'data'
-        self.make_background()
         self.prepare_sprites()
-        #Viewer.players = []
-        # --- create 4 player sprites. They will automatically be members of Viewer.playergroup ---
-        self.corners = [(100,100), (Viewer.width-100,100), (100, Viewer.height-100), (Viewer.width-100, Viewer.height-100)]
-        colors =  [(128,128,255), (0,255,0),              (255,0,0),                (255,255,0)]
-        names =   ["blue",    "green",                "red",                    "yellow"]
-        for nr in range(4):
-              pic = create_picture(color=colors[nr])
-              startpos = pygame.math.Vector2(self.corners[nr][0], self.corners[nr][1])
-              Player(playernumber = nr, pos= startpos, picture=pic, color=colors[nr], name=names[nr])
-
-        for p in Viewer.playergroup:
-            p.valid_targets()
-        self.run()
-
-
-    def make_background(self):
-        """scans the subfolder 'data' for .jpg files, randomly selects
-        one of those as background image. If no files are found, makes a
-        white screen"""
-        try:
-            for root, dirs, files in os.walk("data"):
-                for file in files:
-                    if file[-4:].lower() == ".jpg" or file[-5:].lower() == ".jpeg":
-                        self.backgroundfilenames.append(os.path.join(root, file))
-            random.shuffle(self.backgroundfilenames)  # remix sort order
-            self.background = pygame.image.load(self.backgroundfilenames[0])
-
-        except:
-            print("no folder 'data' or no jpg files in it")
-            self.background = pygame.Surface(self.screen.get_size()).convert()
-            self.background.fill((255, 255, 255))  # fill background white
-
-        self.background = pygame.transform.scale(self.background,
-                                                 (Viewer.width, Viewer.height))
-        self.background.convert()
+        self.create_players(players, bots)
 
     def prepare_sprites(self):
-        """painting on the surface and create sprites"""
-        Viewer.allgroup = pygame.sprite.LayeredUpdates()  # for drawing with layers
-        Viewer.playergroup  = pygame.sprite.OrderedUpdates() # a group maintaining order in list
+        """create the sprite groups"""
+        World.allgroup = LayeredGroup()  # for drawing with layers
+        World.playergroup  = pygame.sprite.OrderedUpdates() # a group maintaining order in list
         self.bulletgroup = pygame.sprite.Group() # simple group for collision testing only
+        self.bubblegroup = pygame.sprite.Group() # Bubble sprites, for the trail canvas of the Viewer
         #self.tracergroup = pygame.sprite.Group()
         #self.mousegroup = pygame.sprite.Group()
         self.explosiongroup = pygame.sprite.Group()
@@ -654,178 +1739,980 @@ class Viewer():
         Player.groups = self.allgroup, self.playergroup
         Beam.groups = self.allgroup, self.bulletgroup
         VectorSprite.groups = self.allgroup
-        Bubble.groups = self.allgroup
+        Bubble.groups = self.allgroup, self.bubblegroup
+        # ---- short-lived sprites are reused ----
+        Beam.pool = SpritePool(Beam)
+        Bubble.pool = SpritePool(Bubble)
+        Flytext.pool = SpritePool(Flytext)
         #Flytext.groups = self.allgroup
         #Explosion.groups = self.allgroup, self.explosiongroup
 
+    def spawn_positions(self, players):
+        """start positions: the 4 corners for up to 4 players, else an ellipse around the center"""
+        if players <= 4:
+            return [(100,100), (World.width-100,100), (100, World.height-100), (World.width-100, World.height-100)][:players]
+        cx, cy = World.width / 2, (World.height + World.hud_height) / 2
+        v = pygame.math.Vector2(1, 0)
+        positions = []
+        for nr in range(players):
+            v.from_polar((1, 360 * nr / players))
+            positions.append((round(cx + (cx - 100) * v.x), round(cy + (cy - World.hud_height - 100) * v.y)))
+        return positions
+
+    def create_players(self, players=4, bots=0):
+        """create the player sprites. They will automatically be members of World.playergroup.
+           The last bots players get their commands from bot_command()"""
+        self.corners = self.spawn_positions(players)
+        colors =  [(128,128,255), (0,255,0),              (255,0,0),                (255,255,0)]
+        names =   ["blue",    "green",                "red",                    "yellow"]
+        World.player_names = {}
+        for nr in range(players):
+              if nr < len(colors):
+                  color, name = colors[nr], names[nr]
+              else:
+                  c = pygame.Color(0)
+                  c.hsva = ((nr * 137.5) % 360, 80, 100, 100) # golden angle: neighbours get different colors
+                  color, name = (c.r, c.g, c.b), "player{}".format(nr + 1)
+              pic = assets.picture(color)
+              startpos = pygame.math.Vector2(self.corners[nr][0], self.corners[nr][1])
+              World.player_names[name] = Player(playernumber = nr, pos= startpos, picture=pic, color=color, name=name)
+        self.bots = range(players - bots, players) # playernumbers
+        self.bot_turns = {}
+        self.reset_players()
+
+    def reset_players(self):
+        """restart and reset all players"""
+        for nr, p in enumerate(World.playergroup):
+            p.hitpoints = p.hitpointsfull
+            p.game_over = False
+            p.set_angle(0)
+            p.cannon_angle = 0
+            p.aiming = "locked" if nr in self.bots else "free"
+            p.target = "nearest"
+            p.move = pygame.math.Vector2(0,0)
+            p.stop_on_edge = True
+            p.pos = pygame.math.Vector2(self.corners[nr][0],self.corners[nr][1])
+        World.targets = ["nearest"] + [p.name for p in World.playergroup]
+
+    def bubble_seed(self, seed):
+        """seed of bubble_rng, derived from seed without taking numbers from World.rng"""
+        return None if seed is None else "bubbles {}".format(seed)
+
+    def restart(self, seed=None):
+        """a new match in this world, without creating it again: new seed, no beams,
+           bubbles or texts, all players back at the start. The same seed gives the same match"""
+        self.seed = seed
+        self.rng.seed(seed)
+        self.bubble_rng.seed(self.bubble_seed(seed))
+        for sprite in self.allgroup.sprites():
+            if not isinstance(sprite, (Player, Crosshair)):
+                sprite.kill()
+        if self.beams is not None:
+            self.beams.count = 0
+        if self.particles is not None:
+            self.particles.count = 0
+            self.particles.rng = np.random.default_rng(self.rng.getrandbits(32))
+        self.ticks = 0
+        self.playtime = 0.0
+        self.bot_turns = {}
+        for p in self.playergroup:
+            p.age = 0
+            p.last_shot = 0
+            p.shots = 0
+            p.hits = 0
+        self.reset_players()
+
+    def bot_command(self, player):
+        """Command for a player steered by the computer: fly around, the cannon is
+           locked on the nearest player. Changes the direction now and then"""
+        if player.playernumber not in self.bot_turns or self.rng.random() < 0.01:
+            self.bot_turns[player.playernumber] = self.rng.uniform(-1, 1)
+        return Command(self.bot_turns[player.playernumber], 1)
+
+    def test_explosion(self):
+        """a lot of bubbles at once"""
+        if self.particles is not None:
+            self.particles.emit(400, 200, (255, 0, 255), 100)
+        else:
+            Bubble.pool.acquire(pos=pygame.math.Vector2(400,200))
+
+    def control(self, player, command, seconds):
+        """apply a Command to a player for a step of seconds"""
+        if command.switches & SWITCH_AIMING:
+            player.switch_aiming()
+        if command.switches & SWITCH_TARGET:
+            player.switch_target()
+        if command.turn < 0:
+            player.turn_left(seconds, -command.turn)
+        elif command.turn > 0:
+            player.turn_right(seconds, command.turn)
+        if command.thrust > 0:
+            player.move_forward(command.thrust)
+        elif command.thrust < 0:
+            player.move_backward(-command.thrust)
+        if command.aim != 0:
+            player.aim(seconds, command.aim)
+
+    def step(self, seconds, commands=None, keys=0):
+        """advance the simulation by seconds: player commands, permanent fire,
+           movement and collision detection.
+           commands is None or a list with one Command (or None) for each player,
+           keys a bitmask of KEY_RESET and KEY_TEST"""
+        profiler = self.profiler
+        if keys & KEY_RESET:
+            self.reset_players()
+        if keys & KEY_TEST:
+            self.test_explosion()
+        players = self.playergroup.sprites()
+        if commands is not None:
+            for player, command in zip(players, commands):
+                if command is not None and player.playernumber not in self.bots:
+                    self.control(player, command, seconds)
+        for nr in self.bots:
+            self.control(players[nr], self.bot_command(players[nr]), seconds)
+        # permanent fire for all players
+        self.player_grid.clear()
+        World.nearest = {}
+        for p in self.playergroup:
+            p.fire()
+            if p.hitpoints > 0:
+                self.player_grid.insert(p, p.pos.x, p.pos.y)
+        if profiler: profiler.lap("fire")
+        # ---- update -----------------
+        self.allgroup.update(seconds)
+        if self.beams is not None:
+            self.beams.update(seconds)
+        if self.particles is not None:
+            self.particles.update(seconds)
+        if profiler: profiler.lap("update")
+        self.collision()
+        if profiler: profiler.lap("collision")
+        self.playtime += seconds
+        self.ticks += 1
+
+    def interpolate(self, alpha):
+        """move the rect of each sprite between its position before and after
+           the last step. alpha 0 is the old position, 1 the new one.
+           Only for drawing, the next step sets the rects again"""
+        alpha = min(1.0, max(0.0, alpha))
+        for s in self.allgroup:
+            if s.old_pos.distance_squared_to(s.pos) > 2500:
+                continue # warped or teleported, no smooth movement
+            x = s.old_pos.x + (s.pos.x - s.old_pos.x) * alpha
+            y = s.old_pos.y + (s.pos.y - s.old_pos.y) * alpha
+            s.rect.center = (round(x, 0), round(y, 0))
+
+    def explode(self, pos, move, angle, color):
+        """explosion with bubbels where a beam hit, most of the time (bubble_chance).
+           Takes one number from World.rng for each hit, whatever bubble_chance is"""
+        if self.rng.random() < self.bubble_chance:
+            if self.particles is not None:
+                if self.max_bubbles is None or len(self.particles) < self.max_bubbles:
+                    self.particles.emit(pos.x, pos.y, color)
+                return
+            if self.max_bubbles is not None and len(self.bubblegroup) >= self.max_bubbles:
+                return
+            v = pygame.math.Vector2(move.x, move.y)
+            v.normalize_ip()
+            v *= self.bubble_rng.randint(60,160) # speed
+            v.rotate_ip(angle + 180 + self.bubble_rng.randint(-20,20))
+            Bubble.pool.acquire(pygame.math.Vector2(pos.x, pos.y), v, 0, color) # pos, move, angle, color
+
+    def collision(self):
+        """collision detection between Player and Beam.
+           Broad phase: only beams in grid cells next to a player and not fired by him are tested"""
+        grid = self.beam_grid
+        beams = self.beams
+        if len(self.bulletgroup) > 0:
+            grid.clear()
+            for beam in self.bulletgroup:
+                grid.insert(beam, beam.pos.x, beam.pos.y, beam.boss)
+        if beams is not None and beams.count > 0:
+            grid.build_array(beams.pos[:beams.count])
+            dead = np.zeros(beams.count, dtype=bool) # beams are removed after all players are tested
+            candidates = grid.candidates_arrays([(p.pos.x, p.pos.y) for p in self.playergroup])
+            players = self.playergroup.sprites()
+        for nr, player in enumerate(self.playergroup):
+            if len(self.bulletgroup) > 0:
+                for beam in grid.candidates(player.pos.x, player.pos.y, player):
+                    if not beam.alive() or not pygame.sprite.collide_circle(player, beam):
+                        continue # need 'radius' attribute for both sprites
+                    player.hitpoints -= beam.damage
+                    if isinstance(beam.boss, Player): # only players count hits, like damage in Beam
+                        beam.boss.hits += 1
+                    self.explode(beam.pos, beam.move, beam.angle, beam.color)
+                    beam.kill()
+                    #beam.hitpoints = 0 # kill later
+            # ---- beams of the BeamSystem ----
+            if beams is not None and beams.count > 0:
+                hits = beams.hits(player.pos, player.radius, player.playernumber, candidates[nr])
+                hits = hits[~dead[hits]]
+                for i in hits.tolist():
+                    player.hitpoints -= int(beams.damage[i])
+                    players[int(beams.owner[i])].hits += 1
+                    self.explode(pygame.math.Vector2(beams.pos[i].tolist()), pygame.math.Vector2(beams.move[i].tolist()),
+                                 float(beams.angle[i]), beams.colors[beams.image[i]])
+                dead[hits] = True
+        if beams is not None and beams.count > 0:
+            beams.kill(np.flatnonzero(dead))
+
+
+class InputSampler():
+    """turns keyboard (player 1) and joysticks (one for each player) into Commands.
+       sample() reads the state of the devices, once for each physics step in the main
+       loop (SDL refreshes it when the main loop gets the events). The switches come
+       from JOYBUTTONUP events (switch()), so a short tap within one frame is not lost"""
+
+    def __init__(self, joysticks, players):
+        self.joysticks = joysticks[:players]
+        self.players = players
+        # ---- lookup tables, only buttons the joystick has, in button order ----
+        self.aim_tables = [tuple((b, JOY_AIM_BUTTONS[b]) for b in sorted(JOY_AIM_BUTTONS) if b < j.get_numbuttons())
+                           for j in self.joysticks]
+        self.numbers = {j.get_instance_id(): number for number, j in enumerate(self.joysticks)} # player of a joystick
+        self.samples = 0
+        self.switches = 0 # button releases given to players
+
+    def sample(self):
+        """read keyboard and joysticks once, returns one Command for each player, without switches"""
+        commands = [Command() for p in range(self.players)]
+        # ------------ pressed keys, for player1 ------
+        pressed_keys = pygame.key.get_pressed()
+        turn = pressed_keys[pygame.K_RIGHT] - pressed_keys[pygame.K_LEFT]
+        thrust = pressed_keys[pygame.K_UP] - pressed_keys[pygame.K_DOWN]
+        aim = pressed_keys[pygame.K_PAGEUP] - pressed_keys[pygame.K_PAGEDOWN]
+        if commands:
+            commands[0] = Command(turn, thrust, aim)
+        # ------ joysticks, player1 may also use the keyboard -------
+        for number, j in enumerate(self.joysticks):
+            x1 = j.get_axis(0)
+            y2 = j.get_axis(3)
+            aim = 0
+            for b, direction in self.aim_tables[number]:
+                if j.get_button(b):
+                    aim = direction # rotate cannon/crosshair while button is pressed down
+            turn, thrust, old_aim, _ = commands[number]
+            commands[number] = Command(turn + x1, -y2 if y2 != 0 else thrust, old_aim + aim)
+        self.samples += 1
+        return commands
+
+    def switch(self, event):
+        """for a JOYBUTTONUP event: (player number, SWITCH_ bits) if the button is a
+           switch button (JOY_SWITCH_BUTTONS) of a player's joystick, else None"""
+        number = self.numbers.get(event.instance_id)
+        bits = JOY_SWITCH_BUTTONS.get(event.button, 0)
+        if number is None or not bits:
+            return None
+        self.switches += 1
+        return number, bits
+
+    def stats(self):
+        return {"samples": self.samples, "switches": self.switches}
+
+
+class InputRecorder():
+    """writes the input of a match to a compact binary file (gzip compressed):
+       a header with seed, screen size, tickrate and number of players and bots, then for each
+       frame the frame time in milliseconds and the physics steps of that frame.
+       Each step is the world keys and turn, thrust, aim (one byte each) and switches
+       for each player. Replay it with replay()"""
+    magic = b"VGR2"
+    header = struct.Struct("<4sqHHHBB?") # magic, seed, width, height, tickrate, players, bots, arrays
+    frame = struct.Struct("<HB") # milliseconds, number of steps
+    scale = 63 # axis 1.0 is stored as 63, keyboard + joystick (2.0) still fits into a byte
+
+    def __init__(self, filename, world):
+        if world.seed is None:
+            raise ValueError("a world without seed can not be replayed")
+        self.filename = filename
+        self.players = len(world.playergroup)
+        self.step_struct = struct.Struct("<B" + "bbbB" * self.players)
+        self.file = gzip.open(filename, "wb")
+        self.file.write(self.header.pack(self.magic, world.seed, World.width, World.height,
+                                         round(1 / world.dt), self.players, len(world.bots),
+                                         world.beams is not None))
+        self.steps = [] # packed steps of the current frame
+        self.frames = 0
+        self.ticks = 0
+
+    @classmethod
+    def quantize(cls, value):
+        return max(-127, min(127, round(value * cls.scale)))
+
+    def step(self, keys, commands):
+        """remember keys and commands for the current frame. Returns the quantized
+           commands: the world must get exactly what the replay will give it"""
+        values = [keys]
+        quantized = []
+        for command in commands:
+            turn, thrust, aim = (self.quantize(v) for v in command[:3])
+            values.extend((turn, thrust, aim, command.switches))
+            quantized.append(Command(turn / self.scale, thrust / self.scale, aim / self.scale, command.switches))
+        self.steps.append(self.step_struct.pack(*values))
+        self.ticks += 1
+        return quantized
+
+    def end_frame(self, milliseconds):
+        """write the frame time and the steps of this frame"""
+        self.file.write(self.frame.pack(min(milliseconds, 65535), len(self.steps)))
+        self.file.write(b"".join(self.steps))
+        self.steps = []
+        self.frames += 1
+
+    def close(self):
+        self.file.close()
+        print("recorded {} frames, {} ticks, {} bytes to {}".format(
+              self.frames, self.ticks, os.path.getsize(self.filename), self.filename))
+
+
+def read_recording(filename):
+    """read a file of InputRecorder. Returns a dict with the header values and a list
+       of frames, each frame (milliseconds, steps), each step (keys, list of Commands).
+       A truncated file (the game was killed while recording) gives the complete frames
+       before the end"""
+    rec = InputRecorder
+    with open(filename, "rb") as f:
+        # zlib instead of gzip.open: gives all it can decompress of a gzip stream without end
+        data = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(f.read())
+    if len(data) < rec.header.size or data[:len(rec.magic)] != rec.magic:
+        raise ValueError("{} is not a recording".format(filename))
+    magic, seed, width, height, tickrate, players, bots, arrays = rec.header.unpack_from(data)
+    header = {"seed": seed, "width": width, "height": height, "tickrate": tickrate,
+              "players": players, "bots": bots, "arrays": arrays}
+    step_struct = struct.Struct("<B" + "bbbB" * players)
+    offset = rec.header.size
+    frames = []
+    while offset + rec.frame.size <= len(data):
+        milliseconds, count = rec.frame.unpack_from(data, offset)
+        offset += rec.frame.size
+        if offset + count * step_struct.size > len(data):
+            break # the last frame is incomplete
+        steps = []
+        for values in step_struct.iter_unpack(data[offset:offset + count * step_struct.size]):
+            commands = [Command(values[i] / rec.scale, values[i+1] / rec.scale, values[i+2] / rec.scale, values[i+3])
+                        for i in range(1, len(values), 4)]
+            steps.append((values[0], commands))
+        offset += count * step_struct.size
+        frames.append((milliseconds, steps))
+    return header, frames
+
+
+class FrameCapture():
+    """saves the frames of the screen without stopping the game loop.
+       grab() only copies the pixels (through the buffer of the screen, a memcpy)
+       into one of 'size' preallocated frame surfaces, encoder threads write them:
+       a .png file for each frame into a folder, or all frames into one raw video
+       file if path ends with .raw (screen pixel format without row padding, described
+       in path + '.json' and by the ffmpeg command of close()).
+       The encoding (zlib) runs without the GIL. If the encoders fall behind,
+       only every second frame is taken while the ring is more than half full,
+       and frames are dropped when it is full. every: take only every n-th frame"""
+
+    def __init__(self, path, screen, size=8, every=1, threads=2, level=1, fps=60):
+        self.path = path
+        self.fps = fps # only for the ffmpeg command
+        self.raw = path.lower().endswith(".raw")
+        self.width, self.height = screen.get_size()
+        self.every = every
+        self.level = level # zlib compression level of png files
+        self.slots = [pygame.Surface(screen.get_size(), 0, screen) for i in range(size)]
+        self.copy = all(slot.get_pitch() == screen.get_pitch() for slot in self.slots) # else blit
+        self.free = queue.Queue() # numbers of unused slots
+        for number in range(size):
+            self.free.put(number)
+        self.jobs = queue.Queue() # (slot number, frame number), None: stop
+        self.frames = 0 # frames seen by grab()
+        self.taken = 0 # frames of them left by every, counts the alternation of decimation
+        self.captured = 0 # frames given to the encoders
+        self.written = 0
+        self.dropped = 0 # ring was full
+        self.decimated = 0 # skipped because the ring was more than half full
+        self.bytes = 0
+        if self.raw:
+            if self.slots[0].get_bytesize() not in (3, 4):
+                raise ValueError("raw capture needs a 24 or 32 bit screen")
+            self.file = open(path, "wb")
+            threads = 1 # frames must be written in order
+            with open(path + ".json", "w") as f:
+                json.dump({"width": self.width, "height": self.height, "pixel_format": self.pixel_format(),
+                           "framerate": self.fps / self.every}, f)
+        else:
+            os.makedirs(path, exist_ok=True)
+        self.threads = [threading.Thread(target=self._run, name="capture", daemon=True) for i in range(threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def grab(self, screen):
+        """take the current screen content, or drop it. Never waits for the encoders"""
+        self.frames += 1
+        if (self.frames - 1) % self.every:
+            return
+        self.taken += 1
+        if self.free.qsize() < len(self.slots) // 2 and self.taken % 2 == 0:
+            self.decimated += 1
+            return
+        try:
+            number = self.free.get_nowait()
+        except queue.Empty:
+            self.dropped += 1
+            return
+        slot = self.slots[number]
+        if self.copy:
+            buffer = slot.get_buffer() # locks the slot until deleted
+            memoryview(buffer)[:] = screen.get_buffer()
+            del buffer
+        else:
+            slot.blit(screen, (0, 0))
+        self.captured += 1
+        self.jobs.put((number, self.frames))
+
+    def _run(self):
+        rgb = pygame.Surface((self.width, self.height), 0, 24, (0xff, 0xff00, 0xff0000, 0)) # byte order of png
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            number, frame = job
+            slot = self.slots[number]
+            if self.raw:
+                self.bytes += self.write_raw(slot)
+            else:
+                rgb.blit(slot, (0, 0))
+                self.bytes += self.write_png(os.path.join(self.path, "frame{:06d}.png".format(frame)), rgb)
+            self.written += 1
+            self.free.put(number)
+
+    def write_raw(self, surface):
+        """append the pixels of surface to the raw file, without the padding at the end
+           of each row (pitch > width * bytes per pixel). Returns the number of bytes"""
+        row = self.width * surface.get_bytesize()
+        pitch = surface.get_pitch()
+        pixels = memoryview(surface.get_buffer())
+        if pitch == row:
+            self.file.write(pixels[:row * self.height])
+        else:
+            for y in range(self.height):
+                self.file.write(pixels[y * pitch:y * pitch + row])
+        del pixels
+        return row * self.height
+
+    def write_png(self, filename, surface):
+        """write a 24 bit RGB surface as png file with zlib, returns the file size"""
+        width, height = surface.get_size()
+        pitch = surface.get_pitch()
+        pixels = memoryview(surface.get_buffer())
+        compressor = zlib.compressobj(self.level)
+        data = []
+        for y in range(height):
+            data.append(compressor.compress(b"\0")) # filter type 0: none
+            data.append(compressor.compress(pixels[y * pitch:y * pitch + 3 * width]))
+        data.append(compressor.flush())
+        del pixels
+        data = b"".join(data)
+
+        def chunk(kind, content):
+            return struct.pack(">I", len(content)) + kind + content + struct.pack(">I", zlib.crc32(kind + content))
+
+        png = (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+               + chunk(b"IDAT", data) + chunk(b"IEND", b""))
+        with open(filename, "wb") as f:
+            f.write(png)
+        return len(png)
+
+    def close(self):
+        """wait until all taken frames are written"""
+        for thread in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.raw:
+            self.file.close()
+        print("capture: {} frames, {} written ({} MB), {} dropped, {} decimated to {}".format(
+              self.frames, self.written, self.bytes // 2**20, self.dropped, self.decimated, self.path))
+        if self.raw:
+            print("convert: ffmpeg -f rawvideo -pixel_format {} -video_size {}x{} -framerate {} -i {} video.mp4".format(
+                  self.pixel_format(), self.width, self.height, round(self.fps / self.every), self.path))
+
+    def pixel_format(self):
+        """ffmpeg name of the pixel format of the raw file (little endian), like bgr0"""
+        slot = self.slots[0]
+        shifts = sorted(zip(slot.get_shifts()[:3], "rgb"))
+        order = "".join(color for shift, color in shifts)
+        return order + "0" if slot.get_bytesize() == 4 else order + "24"
+
+    def stats(self):
+        return {"frames": self.frames, "captured": self.captured, "written": self.written,
+                "dropped": self.dropped, "decimated": self.decimated, "bytes": self.bytes}
 
-        # ------ player1,2,3: mouse, keyboard, joystick ---
+
+class Viewer():
+    """window, input and drawing for a World"""
+
+    def __init__(self,width=800, height=600, seed=None, dirty=False, arrays=True, profile=False, record=None,
+                 players=4, bots=0, trail=False, fade=0.0, capture=None, capture_every=1,
+                 quality=True):
+        """dirty: only update the changed parts of the screen (dirty rects) instead of
+           the full screen, as long as less than dirty_threshold of the screen changes.
+           arrays: beams and bubbles in numpy arrays (if numpy is installed), else as sprites.
+           profile: measure the phases of each frame and show them instead of the fps
+           (F10: overlay on/off, F12: write profile.csv and profile_trace.json).
+           record: filename for an InputRecorder, to replay the match later.
+           players: number of players, the last bots of them are steered by the computer.
+           trail: beams and bubbles paint into a canvas that replaces the background,
+           their strokes stay after they die (dirty is ignored).
+           fade: part of the trail brightness lost per second, 0..1, 0: no fading. Fading trails start on black.
+           capture: folder for a png file of each frame, or a .raw file, see FrameCapture.
+           capture_every: capture only every n-th frame.
+           quality: lower the quality when frames take too long (QualityGovernor).
+           Start the game with run()"""
+        self.profiler = FrameProfiler() if profile else None
+        self.show_profile = profile
+        self.dirty = dirty
+        self.dirty_threshold = 0.4 # part of the screen area
+        self.flips = 0 # frames with full screen update
+        self.updates = 0 # frames with update of dirty rects only
+        self.hud_states = {} # player number: values shown in the hud
+        self.hud_redraws = 0 # number of player parts drawn again in the hud
+        self.hud_every = 1 # look for changes of the hud every n-th frame, set by QualityGovernor
+        self.hud_frames = 0
+        self.fps_text = ""
+        self.fps_frames = 0
+        assert 0 <= fade <= 1, "fade is a part of the brightness, 0..1"
+        self.trail = trail
+        self.fade = fade
+        self.fade_time = 0.0 # seconds of fading not yet applied to the canvas
+        self.startup = StartupTimer()
+        self.startup.lap("import")
+        # ---- pygame init: only display and font, no sound (pygame.init() would start the mixer)
+        pygame.display.init()
+        pygame.font.init()
+        self.screen = pygame.display.set_mode((width, height), pygame.DOUBLEBUF)
+        self.hud_surface = pygame.Surface((width, World.hud_height), pygame.SRCALPHA)
+        self.clock = pygame.time.Clock()
+        self.fps = 60
+        self.startup.lap("display")
+        # ------ joysticks init ----
+        self.joysticks = init_joysticks()
+        self.startup.lap("joysticks")
+        # ------ fonts of hud and fps text, from the cache of font_paths ------
+        get_font(font_size=10)
+        get_font(font_size=18)
+        self.startup.lap("fonts")
+        # ------ background images ------
+        self.make_background()
+        self.startup.lap("background")
+        self.canvas = None # trail canvas, see stamp_trails()
+        if record is not None and seed is None:
+            seed = random.randrange(2**31) # a recording needs a known seed
+        self.world = World(width, height, seed, particles=arrays, beams=arrays, players=players, bots=bots)
+        self.hud_rects = self.hud_layout(players)
+        self.world.profiler = self.profiler
+        if self.trail:
+            self.clear_canvas()
+        self.recorder = InputRecorder(record, self.world) if record is not None else None
+        self.capture = None
+        if capture is not None:
+            self.capture = FrameCapture(capture, self.screen, every=capture_every, fps=self.fps)
+        self.input = InputSampler(self.joysticks, len(World.playergroup))
+        self.governor = None
+        if quality:
+            self.governor = QualityGovernor(self.fps)
+            self.governor.apply(self.world, self)
+        self.startup.lap("world")
+
+    def prewarm(self):
+        """turning and firing should only need rotation_cache lookups.
+           Done after the first frame, it is not needed to show it"""
+        for p in World.playergroup:
+            rotation_cache.prewarm(p.image0)
+            rotation_cache.prewarm(beam_image(p.color))
+
+
+    def make_background(self):
+        """a white background at once. The .jpg files of the subfolder 'data' are loaded
+        and scaled in a thread (Assets.preload_backgrounds), the first one is shown
+        when it is ready. b shows the next one"""
+        self.background = assets.prepare(pygame.Surface(self.screen.get_size()))
+        self.background.fill((255, 255, 255))  # fill background white
+        self.background_number = None # number of the shown preloaded background
+        assets.preload_backgrounds("data", self.screen.get_size())
+
+    def next_background(self):
+        """show the next preloaded background image, if there is one"""
+        number = 0 if self.background_number is None else self.background_number + 1
+        image = assets.background(number)
+        if image is None:
+            return
+        self.background, self.background_number = image, number
+        if self.trail:
+            self.clear_canvas()
+        if hasattr(self, "old_rects"):
+            del self.old_rects # draw_dirty: blit the whole background again
+
+    def clear_canvas(self):
+        """a new trail canvas: the background, or black if the trails fade"""
+        if self.fade:
+            self.canvas = pygame.Surface(self.screen.get_size()).convert()
+            self.canvas.fill((0, 0, 0))
+        else:
+            self.canvas = self.background.copy()
+        self.fade_time = 0.0
+
+    def stamp_trails(self, behind):
+        """trail mode: draw the beams and bubbles of this frame into self.canvas,
+           where they stay. The cost per frame depends only on the living beams and
+           bubbles, not on the strokes already painted. Fading multiplies the
+           canvas with a gray (BLEND_MULT), not every frame but in steps of at
+           least 6%, because a multiply by 254/255 would be rounded away"""
+        canvas = self.canvas
+        if self.fade:
+            self.fade_time += self.clock.get_time() / 1000
+            value = round(255 * (1 - self.fade) ** self.fade_time)
+            if value <= 240:
+                canvas.fill((value, value, value), special_flags=pygame.BLEND_MULT)
+                self.fade_time = 0.0
+        if self.world.particles is not None:
+            self.world.particles.draw(canvas, behind)
+        if self.world.beams is not None:
+            self.world.beams.draw(canvas, behind)
+        canvas.blits([(s.image, s.rect) for group in (self.world.bubblegroup, self.world.bulletgroup)
+                      for s in group], doreturn=False)
+
+    def count_blits(self):
+        """count slow blits (Assets.check) of the background and the sprites, only when profiling.
+           Particles and beams of the arrays always use images of assets"""
+        assets.check([self.canvas if self.trail else self.background] + [s.image for s in World.allgroup])
+
+    def hud_layout(self, players):
+        """a rect in the hud for each player: one row for up to 8 players, else two rows"""
+        rows = 1 if players <= 8 else 2
+        columns = -(-players // rows)
+        length = World.width // columns
+        height = World.hud_height // rows
+        return [pygame.Rect(nr % columns * length, nr // columns * height, length, height) for nr in range(players)]
 
     def hud(self):
-        """make a Head Up Display on the top of the screen with bars for player hitpoints"""
-        y = Viewer.hud_height
-        for nr, p in enumerate(self.playergroup):
+        """make a Head Up Display on the top of the screen with bars for player hitpoints.
+           The hud is kept in self.hud_surface, the part of a player is only drawn
+           again if hitpoints, aiming, target or alive of that player changed.
+           Changes are only looked for every hud_every frames"""
+        self.hud_frames += 1
+        for nr, p in enumerate(World.playergroup if self.hud_frames % self.hud_every == 0 else ()):
+            state = (p.hitpoints, p.aiming, p.target, p.alive())
+            if self.hud_states.get(nr) == state:
+                continue
+            self.hud_states[nr] = state
+            self.hud_redraws += 1
+            segment = self.hud_rects[nr]
+            self.hud_surface.set_clip(segment)
+            self.hud_surface.fill((0, 0, 0, 0)) # transparent
             percent = p.hitpoints / p.hitpointsfull
-            length = Viewer.width // 4
-            pygame.draw.rect(self.screen, p.color, (nr * length +1 , 1 , int(length * percent)-2, y-1), 0) # fill
-            pygame.draw.rect(self.screen, (0, 0, 0), (nr * length, 0, length, y), 1)  # black border
+            pygame.draw.rect(self.hud_surface, p.color, (segment.x +1 , segment.y + 1 , int(segment.width * percent)-2,
+                                                         segment.height-1), 0) # fill
+            pygame.draw.rect(self.hud_surface, (0, 0, 0), segment, 1)  # black border
+            if segment.height < World.hud_height:
+                continue # too small for text
             if p.hitpoints <= 0:
                 t = "Game Over"
             else:
                 t = p.aiming + ("  (" if p.aiming != "locked" else " --> ") + p.target + (")" if p.aiming != "locked" else "")
-            write(background=self.screen, text=t, x= nr*length + 50, y=5,
+            write(background=self.hud_surface, text=t, x= segment.x + (50 if segment.width >= 200 else 5), y=5,
                   color=(0,0,0), bold=True, font_size=10)
+        self.hud_surface.set_clip(None)
+        self.screen.blit(self.hud_surface, (0, 0))
+
+    def write_fps(self):
+        """fps text in the bottomright corner, or the profiler overlay. Returns the rect"""
+        if self.profiler and self.show_profile:
+            return self.profiler.draw_overlay(self.screen, World.width - 5, World.height - 5, self.clock.get_fps(),
+                                              quality=self.governor.level if self.governor else None)
+        if self.fps_frames % 15 == 0: # clock.get_fps() is an average anyway
+            self.fps_text = "FPS: {:8.3}".format(self.clock.get_fps())
+            if self.governor and self.governor.level > 0:
+                self.fps_text += "  quality level {}".format(self.governor.level)
+        self.fps_frames += 1
+        return write(self.screen, text=self.fps_text, origin="bottomright", x=World.width - 5, y=World.height - 5,
+                     font_size=18, color=(200, 40, 40))
+
+    def draw(self, behind):
+        """draw the whole screen and flip. behind: seconds since the interpolated positions"""
+        profiler = self.profiler
+        # -------------------------delete everything on screen--------------------------------------
+        if self.trail:
+            self.stamp_trails(behind)
+            self.screen.blit(self.canvas, (0, 0))
+            if profiler: profiler.lap("background")
+            self.screen.blits([(s.image, s.rect) for s in World.allgroup if not isinstance(s, (Beam, Bubble))],
+                              doreturn=False)
+        else:
+            self.screen.blit(self.background, (0, 0))
+            if profiler: profiler.lap("background")
+            if self.world.particles is not None:
+                self.world.particles.draw(self.screen, behind)
+            World.allgroup.draw(self.screen)
+            if self.world.beams is not None:
+                self.world.beams.draw(self.screen, behind)
+        if profiler:
+            self.count_blits()
+            profiler.lap("draw")
+        # write text below sprites
+        self.write_fps()
+        if profiler: profiler.lap("fps")
+        # ----- hud ----
+        self.hud()
+        if profiler: profiler.lap("hud")
+        # -------- next frame -------------
+        pygame.display.flip()
+        if profiler: profiler.lap("flip")
+
+    def draw_dirty(self, behind):
+        """like draw(), but erase and update only the changed rects (sprites, particles,
+           beams, fps text and hud). Falls back to a full flip if too much changed"""
+        screen, background = self.screen, self.background
+        profiler = self.profiler
+        if not hasattr(self, "old_rects"):
+            screen.blit(background, (0, 0)) # first frame: everything
+            self.old_rects = [screen.get_rect()]
+        # ---- erase last frame: particles, beams and fps text, sprites, hud ----
+        for rect in self.old_rects:
+            screen.blit(background, rect, rect)
+        World.allgroup.clear(screen, background)
+        hud_rect = pygame.Rect(0, 0, World.width, World.hud_height + 1)
+        screen.blit(background, hud_rect, hud_rect)
+        if profiler: profiler.lap("background")
+        # ---- draw ----
+        rects = []
+        if self.world.particles is not None:
+            rects.extend(self.world.particles.draw(screen, behind, rects=True))
+        sprite_rects = World.allgroup.draw(screen)
+        if self.world.beams is not None:
+            rects.extend(self.world.beams.draw(screen, behind, rects=True))
+        if profiler:
+            self.count_blits()
+            profiler.lap("draw")
+        rects.append(self.write_fps())
+        if profiler: profiler.lap("fps")
+        self.hud()
+        if profiler: profiler.lap("hud")
+        # ---- update the screen: old and new places ----
+        dirty = self.old_rects + rects + sprite_rects
+        dirty.append(hud_rect)
+        self.old_rects = rects
+        area = sum(r.width * r.height for r in dirty)
+        if area > self.dirty_threshold * World.width * World.height:
+            pygame.display.flip()
+            self.flips += 1
+        else:
+            pygame.display.update(dirty)
+            self.updates += 1
+        if profiler: profiler.lap("flip")
+
+    def read_input(self, switches):
+        """Commands of the InputSampler for a physics step, returns a list with one
+           Command for each player. switches is a list with the switch bitmask for each player, from events"""
+        commands = self.input.sample()
+        for nr, switch in enumerate(switches):
+            if switch:
+                commands[nr] = commands[nr]._replace(switches=commands[nr].switches | switch)
+        if self.profiler: self.profiler.lap("input")
+        return commands
 
     def run(self):
-        """The mainloop"""
+        """The mainloop. Physics runs with the fixed World.dt, independent of
+           the frame rate. Drawing is interpolated between the last two steps"""
         running = True
         #pygame.mouse.set_visible(False)
-        oldleft, oldmiddle, oldright = False, False, False
-        pygame.display.set_caption("use 4 joysticks for 4 players.Change aimingmode and target with buttons")
-        Flytext(pos=pygame.math.Vector2(Viewer.width//2,Viewer.height//2), text="player 1 keys: cursor, home/end, pgup/pgdown")
-        while running:
-            #print(self.playergroup[0].pos, self.playergroup[0].cannon_angle)
-            milliseconds = self.clock.tick(self.fps)  #
-            seconds = milliseconds / 1000
-            self.playtime += seconds
-            # -------- events ------
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
-                # ------- pressed and released key ------
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_ESCAPE:
+        pygame.display.set_caption("use a joystick for each player.Change aimingmode and target with buttons")
+        Flytext.pool.acquire(pos=pygame.math.Vector2(World.width//2,World.height//2), text="player 1 keys: cursor, home/end, pgup/pgdown")
+        dt = self.world.dt
+        accumulator = 0.0 # seconds not yet simulated
+        max_steps = 8 # physics steps per frame. If the computer is too slow, the game slows down
+        switches = [0 for p in World.playergroup] # button presses not yet given to the world
+        keys = 0 # KEY_RESET and KEY_TEST not yet given to the world
+        try:
+            while running:
+                milliseconds = self.clock.tick(self.fps)  #
+                frame_start = time.perf_counter() # busy time of this frame, for the governor
+                seconds = milliseconds / 1000
+                if self.profiler: self.profiler.begin_frame()
+                # -------- events ------
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT:
                         running = False
-                    #if event.key == pygame.K_SPACE:
-                    #  self.playergroup[0].fire()
-                    # ---- for player1 ---
-                    if event.key == pygame.K_HOME:
-                        self.playergroup.sprites()[0].switch_aiming()
-                    if event.key == pygame.K_END:
-                        self.playergroup.sprites()[0].switch_target()
-                    #--test
-                    if event.key == pygame.K_x:
-                        Bubble(pos=pygame.math.Vector2(400,200))
-                    # ---- restart and reset all players -----
-                    if event.key == pygame.K_r:
-                        #for nr, p in enumerate(Viewer.playergroup.sprites()):
-                        for nr, p in enumerate(Viewer.playergroup):
-                            p.hitpoints = p.hitpointsfull
-                            p.set_angle(0)
-                            p.cannon_angle = 0
-                            p.aiming = "free"
-                            p.target = "nearest"
-                            p.move = pygame.math.Vector2(0,0)
-                            p.stop_on_edge = True
-                            p.pos = pygame.math.Vector2(self.corners[nr][0],self.corners[nr][1])
-
-                # --- joy button up --
-                elif event.type == pygame.JOYBUTTONUP:
-                    #print(event) <Event(11-JoyButtonUp {'joy': 0, 'button': 0})>
-                    #switch aiming mode of player of that joystick if first button was released
-                    if event.button == 0 or event.button == 6:
-                        self.playergroup.sprites()[event.joy].switch_aiming()
-                    if event.button == 1 or event.button == 7:
-                        self.playergroup.sprites()[event.joy].switch_target()
-
-                #elif event.type == pygame.JOYBUTTONDOWN:
-
-            # ------------ pressed keys ------
-            pressed_keys = pygame.key.get_pressed()
-            if pressed_keys[pygame.K_RIGHT]:
-                self.playergroup.sprites()[0].turn_right(seconds)
-                # self.playergroup.sprites()[0] is player1
-            if pressed_keys[pygame.K_LEFT]:
-                self.playergroup.sprites()[0].turn_left(seconds)
-            if pressed_keys[pygame.K_UP]:
-                self.playergroup.sprites()[0].move_forward()
-            if pressed_keys[pygame.K_DOWN]:
-                self.playergroup.sprites()[0].move_backward()
-            if pressed_keys[pygame.K_PAGEUP]:
-                self.playergroup.sprites()[0].cannon_angle += self.playergroup.sprites()[0].cannon_turn_speed * seconds
-            if pressed_keys[pygame.K_PAGEDOWN]:
-                self.playergroup.sprites()[0].cannon_angle -= self.playergroup.sprites()[0].cannon_turn_speed * seconds
-
-
-            # ------ mouse handler ------
-            left, middle, right = pygame.mouse.get_pressed()
-            # if oldleft and not left:
-            #    self.launchRocket(pygame.mouse.get_pos())
-            oldleft, oldmiddle, oldright = left, middle, right
-
-            # ------ joystick handler -------
-            for number, j in enumerate(self.joysticks):
-                #if number == 0:
-                    x1 = j.get_axis(0)
-                    #y1 = j.get_axis(1)
-                    #x2 = j.get_axis(2)
-                    y2 = j.get_axis(3)
-                    #x3, y3 = j.get_hat(0) # get  hat movement
-
-                    buttons = j.get_numbuttons()
-                    for b in range(buttons):
-                        pushed = j.get_button(b)
-                        # rotate cannon/crosshair while buttons are pressed down
-                        # (for single button press (and relase), use events
-                        if pushed and (b == 4 or b == 3):
-                            self.playergroup.sprites()[number].aim(seconds, -1)
-                        if pushed and (b == 5 or b== 2):
-                            self.playergroup.sprites()[number].aim(seconds, 1)
-                        #    self.playergroup[number].switch_aiming()
-
-                    # ----- control 4 players with 4 joysticks
-                    if x1 < 0:
-                        self.playergroup.sprites()[number].turn_left(seconds, abs(x1))
-                    if x1 > 0:
-                        self.playergroup.sprites()[number].turn_right(seconds, abs(x1))
-                    if y2 < 0:
-                        self.playergroup.sprites()[number].move_forward(abs(y2))
-                    if y2 > 0:
-                        self.playergroup.sprites()[number].move_backward(abs(y2))
-                    # -- control aiming with second stick of joystick
-
-            # permanent fire for all players
-            for p in self.playergroup:
-                p.fire()
-
-            # -------------------------delete everything on screen--------------------------------------
-            self.screen.blit(self.background, (0, 0))
-
-            # ---- update -----------------
-            self.allgroup.update(seconds)
-
-            # --------- collision detection between Player and Beam -----
-            for player  in self.playergroup:
-                crashgroup = pygame.sprite.spritecollide(player, self.bulletgroup,
-                             False, pygame.sprite.collide_circle) # need 'radius' attribute for both sprites
-                for beam in crashgroup:
-                    if beam.boss == player:
-                        continue
-                    player.hitpoints -= beam.damage
-                    # explosion with bubbels
-                    if random.random() < 0.85:
-                        v = pygame.math.Vector2(beam.move.x, beam.move.y)
-                        v.normalize_ip()
-                        v *= random.randint(60,160) # speed
-                        v.rotate_ip(beam.angle + 180 + random.randint(-20,20))
-                        Bubble(pos=pygame.math.Vector2(beam.pos.x, beam.pos.y), color=beam.color,
-                               move=v)
-                    beam.kill()
-                    #beam.hitpoints = 0 # kill later
-            # ----------- draw  -----------------
-            self.allgroup.draw(self.screen)
-            # write text below sprites
-            fps_text = "FPS: {:8.3}".format(self.clock.get_fps())
-            write(self.screen, text=fps_text, origin="bottomright", x=Viewer.width - 5, y=Viewer.height - 5,
-                  font_size=18, color=(200, 40, 40))
-            # ----- hud ----
-            self.hud()
-            # -------- next frame -------------
-            pygame.display.flip()
+                    # ------- pressed and released key ------
+                    elif event.type == pygame.KEYDOWN:
+                        if event.key == pygame.K_ESCAPE:
+                            running = False
+                        # ---- for player1 ---
+                        if event.key == pygame.K_HOME:
+                            switches[0] |= SWITCH_AIMING
+                        if event.key == pygame.K_END:
+                            switches[0] |= SWITCH_TARGET
+                        #--test
+                        if event.key == pygame.K_x:
+                            keys |= KEY_TEST
+                        # ---- restart and reset all players -----
+                        if event.key == pygame.K_r:
+                            keys |= KEY_RESET
+                            if self.trail:
+                                self.clear_canvas()
+                        # ---- profiler ----
+                        if event.key == pygame.K_F10:
+                            self.show_profile = not self.show_profile
+                        if event.key == pygame.K_F12 and self.profiler:
+                            self.profiler.dump()
+                        if event.key == pygame.K_b:
+                            self.next_background()
+
+                    # --- joy button up: switch aiming mode or target (JOY_SWITCH_BUTTONS) ---
+                    elif event.type == pygame.JOYBUTTONUP:
+                        found = self.input.switch(event)
+                        if found:
+                            number, bits = found
+                            switches[number] |= bits
+
+                if self.background_number is None and assets.backgrounds:
+                    self.next_background() # the first preloaded background is ready
+                if self.profiler: self.profiler.lap("events")
+
+                # ---- fixed physics steps: input, fire, update, collision detection -----
+                accumulator += seconds
+                steps = 0
+                while accumulator >= dt and steps < max_steps:
+                    commands = self.read_input(switches)
+                    switches = [0 for s in switches] # each button press only for one step
+                    if self.recorder:
+                        commands = self.recorder.step(keys, commands)
+                    self.world.step(dt, commands, keys)
+                    keys = 0
+                    accumulator -= dt
+                    steps += 1
+                if steps == max_steps:
+                    accumulator = min(accumulator, dt)
+                if self.recorder:
+                    self.recorder.end_frame(milliseconds)
+
+                # ----------- draw  -----------------
+                self.world.interpolate(accumulator / dt)
+                if self.dirty and not self.trail:
+                    self.draw_dirty(dt - accumulator)
+                else:
+                    self.draw(dt - accumulator)
+                if self.capture:
+                    self.capture.grab(self.screen)
+                    if self.profiler: self.profiler.lap("capture")
+                if not self.startup.done:
+                    self.startup.finish("first frame")
+                    self.prewarm()
+                elif self.governor and self.governor.frame((time.perf_counter() - frame_start) * 1000) is not None:
+                    self.governor.apply(self.world, self)
+                    number, old, new, ms = self.governor.transitions[-1]
+                    print("quality: level {} -> {} ({:.1f} ms per frame)".format(old, new, ms))
+        finally:
+            # also after an exception: a closed recording can be replayed, taken frames are written
+            if self.recorder:
+                self.recorder.close()
+            if self.capture:
+                self.capture.close()
         # -----------------------------------------------------
+        print("font paths:", font_paths.stats())
+        print("text cache:", text_cache.stats())
+        print("rotation cache:", rotation_cache.stats())
+        print("assets:", assets.stats())
+        if self.governor:
+            print("quality:", self.governor.stats())
+        for sprite_class in (Beam, Bubble, Flytext):
+            print(sprite_class.__name__, "pool:", sprite_class.pool.stats())
+        print("input:", self.input.stats())
+        print("hud: {} redraws of player parts".format(self.hud_redraws))
+        if self.dirty:
+            print("dirty rects: {} full screen updates, {} partial updates".format(self.flips, self.updates))
+        if self.profiler:
+            self.profiler.dump()
         pygame.mouse.set_visible(True)
         pygame.quit()
 
 
+def replay(filename):
+    """replay a recording of InputRecorder without display, as fast as possible.
+       Returns the world after the last step and the simulation time in seconds
+       of each recorded frame"""
+    header, frames = read_recording(filename)
+    init_headless()
+    world = World(header["width"], header["height"], header["seed"],
+                  particles=header["arrays"], beams=header["arrays"],
+                  players=header["players"], bots=header["bots"])
+    world.dt = 1 / header["tickrate"]
+    times = []
+    for milliseconds, steps in frames:
+        start = time.perf_counter()
+        for keys, commands in steps:
+            world.step(world.dt, commands, keys)
+        times.append(time.perf_counter() - start)
+    return world, times
+
+
+def run_headless(ticks=10000, width=1024, height=800, seed=None, players=4, bots=0):
+    """run a World for some ticks without display, returns ticks per second"""
+    init_headless()
+    world = World(width, height, seed, players=players, bots=bots)
+    start = time.perf_counter()
+    for _ in range(ticks):
+        world.step(world.dt)
+    return ticks / (time.perf_counter() - start)
+
+
 if __name__ == '__main__':
-    Viewer(width=1024, height=800)
+    parser = argparse.ArgumentParser(description="2d vector game, 4 players or more")
+    parser.add_argument("--headless", type=int, metavar="TICKS",
+                        help="run the simulation for TICKS steps without display and report ticks per second")
+    parser.add_argument("--seed", type=int, help="seed for the random generator of the world")
+    parser.add_argument("--dirty", action="store_true",
+                        help="update only changed parts of the screen (faster on slow computers)")
+    parser.add_argument("--sprites", action="store_true",
+                        help="beams and bubbles as sprites instead of numpy arrays")
+    parser.add_argument("--profile", action="store_true",
+                        help="show the time of each phase of a frame (F10), save it with F12 and at exit")
+    parser.add_argument("--joysticks", action="store_true",
+                        help="always start the joysticks, even if none is found (VECTORGAME_JOYSTICKS=1)")
+    parser.add_argument("--players", type=int, default=4, help="number of players")
+    parser.add_argument("--bots", type=int, default=0, help="how many of the players are steered by the computer")
+    parser.add_argument("--split", action="store_true",
+                        help="simulation in a second process, drawing from shared memory (needs numpy)")
+    parser.add_argument("--trail", action="store_true",
+                        help="beams and bubbles leave their strokes on the screen (long exposure)")
+    parser.add_argument("--fade", type=float, default=0.0, metavar="PART",
+                        help="with --trail: part of the trail brightness lost per second, 0 to 1, like 0.3")
+    parser.add_argument("--capture", metavar="PATH",
+                        help="save each frame: png files into the folder PATH, or raw video if PATH ends with .raw")
+    parser.add_argument("--capture-every", type=int, default=1, metavar="N", help="with --capture: only every N-th frame")
+    parser.add_argument("--fixed-quality", action="store_true",
+                        help="never lower the quality (bubbles, hud, crosshair) to hold the frame rate")
+    parser.add_argument("--record", metavar="FILE", help="record the input of the match to FILE")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="replay a recorded match without display and report ticks per second")
+    args = parser.parse_args()
+    if args.players < 1 or not 0 <= args.bots <= args.players:
+        parser.error("--players must be at least 1 and --bots between 0 and --players")
+    if not 0 <= args.fade <= 1:
+        parser.error("--fade must be between 0 and 1")
+    if args.fade and not args.trail:
+        parser.error("--fade only works with --trail")
+    if args.joysticks:
+        os.environ["VECTORGAME_JOYSTICKS"] = "1"
+    if args.headless is not None:
+        print("{:.0f} ticks per second".format(run_headless(args.headless, seed=args.seed,
+                                                                 players=args.players, bots=args.bots)))
+    elif args.replay is not None:
+        world, times = replay(args.replay)
+        print("{} frames, {} ticks, {:.0f} ticks per second".format(len(times), world.ticks, world.ticks / sum(times)))
+        for p in world.playergroup:
+            print("{}: {} hitpoints".format(p.name, p.hitpoints))
+    elif args.split:
+        import sharedworld
+        sharedworld.SplitViewer(width=1024, height=800, seed=args.seed, players=args.players, bots=args.bots).run()
+    else:
+        Viewer(width=1024, height=800, seed=args.seed, dirty=args.dirty, arrays=not args.sprites,
+               profile=args.profile, record=args.record,
+               players=args.players, bots=args.bots, trail=args.trail, fade=args.fade,
+               capture=args.capture, capture_every=args.capture_every, quality=not args.fixed_quality).run()